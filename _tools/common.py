@@ -0,0 +1,173 @@
+"""
+flow / supplement / download 共用的工具：HTTP 重试退避与 Retry-After 解析、npm semver range 选版本。
+只依赖标准库，flow 在未安装 aiohttp / PyYAML 时也能 import。
+"""
+
+import email.utils
+import functools
+import random
+import re
+import time
+
+RETRY_BASE_DELAY = 1.0   # 重试退避基数（秒），第 n 次重试等待 base * 2**n 并加 0~50% 抖动
+RETRY_MAX_DELAY = 30.0   # 单次退避上限（秒）
+
+_VER_TRIPLE_RE = re.compile(r'^(\d+)\.(\d+)\.(\d+)')
+
+
+# ===== HTTP 重试 =====
+def backoff_delay(attempt):
+    """指数退避 + 抖动，避免大量失败请求同时重试。"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * (1 + random.random() * 0.5)
+
+
+def retry_after_delay(headers):
+    """解析 429/503 响应头的 Retry-After（秒数或 HTTP 日期），上限 RETRY_MAX_DELAY；没有或无法解析时返回 None。
+    headers 为 aiohttp / requests 的响应头（大小写不敏感的映射），可为 None。"""
+    value = (headers.get('Retry-After') if headers else None) or ''
+    value = value.strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return min(RETRY_MAX_DELAY, float(value))
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        return None
+    return max(0.0, min(RETRY_MAX_DELAY, when.timestamp() - time.time()))
+
+
+def is_retryable_status(status):
+    """5xx 与 429 视为临时错误可重试；其余 4xx（含 404）重试无意义。"""
+    return status >= 500 or status == 429
+
+
+# ===== semver range 选版本 =====
+@functools.lru_cache(maxsize=8192)
+def parse_version_tuple(version_str):
+    """将 4.6.7 或 4.6.7-beta.1 解析为 (4, 6, 7) 用于比较，预发布只取数字部分。"""
+    m = _VER_TRIPLE_RE.match(str(version_str).strip())
+    if m:
+        return (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    return (0, 0, 0)
+
+
+@functools.lru_cache(maxsize=8192)
+def version_sort_key(version_str):
+    """完整 semver 排序键（同 registry.version_sort_key）：先比 x.y.z，同号时正式版大于预发布版，
+    预发布标识逐段比较，数字段按数值且小于字母段；构建元数据（+ 之后）不参与排序。
+    parse_version_tuple 只看 x.y.z，排序时 1.0.0-alpha.2 与 1.0.0-alpha.10、1.0.0 都会并列。"""
+    core, sep, pre = str(version_str).strip().partition('+')[0].partition('-')
+    if not sep:
+        return (*parse_version_tuple(core), 1, ())
+    ids = tuple((0, int(p), '') if p.isdigit() else (1, 0, p) for p in pre.split('.'))
+    return (*parse_version_tuple(core), 0, ids)
+
+
+# range 前缀编码为整数，比较时走整数分支而非字符串相等
+_OP_CARET, _OP_TILDE, _OP_GE, _OP_GT, _OP_LE, _OP_LT, _OP_EQ, _OP_NONE = range(8)
+_OP_CODES = {'^': _OP_CARET, '~': _OP_TILDE, '>=': _OP_GE, '>': _OP_GT,
+             '<=': _OP_LE, '<': _OP_LT, '=': _OP_EQ, '': _OP_NONE}
+_RANGE_WILDCARDS = ('*', 'x', 'X', 'latest')
+# 一个条件: 可选前缀 + 主版本号[.次版本号[.补丁号]]
+_RANGE_COND_RE = re.compile(r'^(\^|~|>=|>|<=|<|=)?\s*(\d+)(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?')
+
+
+@functools.lru_cache(maxsize=8192)
+def _compile_range(range_str):
+    """将 range 预解析为 ((条件, ...), ...)：外层为 || 分隔的备选（任一满足），
+    内层为空格分隔的条件（全部满足），条件为 (op, major, minor, patch, has_minor, has_patch)。
+    空条件元组表示恒满足；无法解析的备选直接丢弃（恒不满足）。
+    支持: *, x, ^, ~, >=, >, <=, <, =, ||, 省略 minor/patch 简写(^4, >=2, 1.x)。"""
+    range_str = (range_str or '').strip()
+    if not range_str or range_str in _RANGE_WILDCARDS:
+        return ((),)
+    alternatives = []
+    for part in range_str.split('||') if '||' in range_str else (range_str,):
+        rest = part.strip()
+        conds = []
+        while rest and rest not in _RANGE_WILDCARDS:
+            m = _RANGE_COND_RE.match(rest)
+            if not m:
+                conds = None
+                break
+            minor_raw, patch_raw = m.group(3), m.group(4)
+            has_minor = minor_raw is not None and minor_raw not in ('x', 'X', '*')
+            has_patch = patch_raw is not None and patch_raw not in ('x', 'X', '*')
+            conds.append((
+                _OP_CODES[m.group(1) or ''],
+                int(m.group(2)),
+                int(minor_raw) if has_minor else 0,
+                int(patch_raw) if has_patch else 0,
+                has_minor,
+                has_patch,
+            ))
+            rest = rest[m.end():].strip()
+        if conds is not None:
+            alternatives.append(tuple(conds))
+    return tuple(alternatives)
+
+
+def _eval_range(v, compiled):
+    """判断版本元组 v 是否满足 _compile_range 的结果；纯整数比较，无正则、无递归。"""
+    for conds in compiled:
+        for op, major, minor, patch, has_minor, has_patch in conds:
+            b = (major, minor, patch)
+            if op == _OP_CARET:
+                # ^major: >= major.0.0 < (major+1).0.0   (major > 0)
+                # ^0.minor: >= 0.minor.0 < 0.(minor+1).0 (minor > 0)
+                # ^0.0.patch: 精确匹配
+                if major > 0:
+                    ok = v >= b and v[0] == major
+                elif has_minor and minor > 0:
+                    ok = v >= b and v[0] == 0 and v[1] == minor
+                elif has_patch:
+                    ok = v == b
+                else:
+                    ok = v[0] == major
+            elif op == _OP_TILDE:
+                # ~major.minor[.patch]: >= b < major.(minor+1).0
+                # ~major: >= major.0.0 < (major+1).0.0
+                ok = v >= b and v[0] == major and (not has_minor or v[1] == minor)
+            elif op == _OP_GE:
+                ok = v >= b
+            elif op == _OP_GT:
+                ok = v > b
+            elif op == _OP_LE:
+                ok = v <= b
+            elif op == _OP_LT:
+                ok = v < b
+            elif op == _OP_EQ:
+                ok = v == b
+            elif not has_minor:
+                ok = v[0] == major          # "2" → 任意 2.x.x
+            elif not has_patch:
+                ok = v[0] == major and v[1] == minor  # "1.2" → 任意 1.2.x
+            else:
+                ok = v == b                 # 精确匹配
+            if not ok:
+                break
+        else:
+            return True
+    return False
+
+
+def pick_best_version(versions_dict, range_str, sorted_versions=None):
+    """从 versions 的 key 中选一个满足 range 的最高正式版，没有则返回 None。
+    按版本降序遍历，命中第一个即返回；sorted_versions 可传入已排好序的列表以免重复排序。
+    预发布版与 npm semver 一致：只有 range 本身就是该预发布版（精确版本）时才选。带预发布标识的
+    比较条件（^1.2.3-beta.1 等）_compile_range 解析不了，整体判为不满足返回 None，由调用方另行处理；
+    parse_version_tuple 只看 x.y.z，若不排除预发布版，2.0.0-beta.1 会被当作满足 ^2.0.0。"""
+    range_str = (range_str or '').strip()
+    exact = range_str.lstrip('=v').strip()
+    if '-' in exact and exact in versions_dict:
+        return exact
+    compiled = _compile_range(range_str)
+    if sorted_versions is None:
+        sorted_versions = sorted(versions_dict, key=version_sort_key, reverse=True)
+    for ver in sorted_versions:
+        if '-' not in ver and _eval_range(parse_version_tuple(ver), compiled):
+            return ver
+    return None
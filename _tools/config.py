@@ -1,36 +1,98 @@
 """
 项目配置 + 平台初始化。各脚本顶部 import config 即可。
-用户直接修改下方变量值来调整配置。
+用户直接修改下方 _Config 字段默认值来调整配置；也可用 V3_<字段名大写> 环境变量临时覆盖。
 """
 
 import io
 import os
 import sys
+from dataclasses import dataclass, fields
 from pathlib import Path
 
 # ===== 项目配置（按需修改） =====
 
-# 是否跳过阶段一（下载）。1=跳过，0=不跳过
-SKIP_PHASE1 = 0
 
-# 本地 registry 端口（npm install --registry http://127.0.0.1:端口）
-LOCAL_REGISTRY_PORT = 4874
+@dataclass(frozen=True, slots=True)
+class _Config:
+    # 是否跳过阶段一（下载）。1=跳过，0=不跳过
+    skip_phase1: int = 0
 
-# 阶段一下载镜像（加速源），用于从 lock 批量下载 tgz
-DOWNLOAD_REGISTRY = "https://registry.npmmirror.com"
+    # 本地 registry 端口（npm install --registry http://127.0.0.1:端口）
+    local_registry_port: int = 4874
 
-# 补包公网源（npm view 查 tarball），阶段二缺包时使用
-NPM_PUBLIC_REGISTRY = "https://registry.npmjs.org"
+    # 阶段一下载镜像（加速源），用于从 lock 批量下载 tgz
+    download_registry: str = "https://registry.npmmirror.com"
 
-# 下载超时（秒）
-DOWNLOAD_TIMEOUT = 30
+    # 补包公网源（npm view 查 tarball），阶段二缺包时使用
+    npm_public_registry: str = "https://registry.npmjs.org"
 
-# 并发下载数
-DOWNLOAD_CONCURRENCY = 10
+    # 下载超时（秒）
+    download_timeout: int = 30
+
+    # 并发下载数
+    download_concurrency: int = 10
+
+    # 补包 / 日志补下的并发下载线程数（流程中按需下载 tarball 时使用）
+    parallel_downloads: int = 8
+
+    # 补包解析缓存有效期（秒）：(name, range) → tarball 的结果在多轮 / 多次运行间复用
+    resolve_cache_ttl: int = 600
+
+
+# 整数项的取值下限：未列出的（并发数、端口等）至少为 1；端口另有上限
+_INT_MINIMUMS = {"skip_phase1": 0, "resolve_cache_ttl": 0}
+_INT_MAXIMUMS = {"local_registry_port": 65535}
+
+
+def _env_int(name: str, default: int, minimum: int = 1, maximum: int | None = None) -> int:
+    """读取整数环境变量；不是整数或越界时打印警告（指明变量名）并回退默认值，不让各脚本在导入时崩溃。"""
+    v = (os.environ.get(name) or "").strip()
+    if not v:
+        return default
+    try:
+        value = int(v)
+    except ValueError:
+        print(f"警告: 环境变量 {name}={v!r} 不是整数，改用默认值 {default}", file=sys.stderr)
+        return default
+    if value < minimum or (maximum is not None and value > maximum):
+        bound = f"{minimum}~{maximum}" if maximum is not None else f">= {minimum}"
+        print(f"警告: 环境变量 {name}={value} 超出范围（{bound}），改用默认值 {default}", file=sys.stderr)
+        return default
+    return value
+
+
+def _load_config() -> _Config:
+    """以 _Config 默认值为基础，按 V3_<字段名大写> 环境变量覆盖（如 V3_DOWNLOAD_CONCURRENCY=32）。"""
+    defaults = _Config()
+    overrides = {}
+    for f in fields(_Config):
+        env_name = f"V3_{f.name.upper()}"
+        default = getattr(defaults, f.name)
+        if isinstance(default, int):
+            overrides[f.name] = _env_int(
+                env_name, default, _INT_MINIMUMS.get(f.name, 1), _INT_MAXIMUMS.get(f.name)
+            )
+        else:
+            overrides[f.name] = os.environ.get(env_name, default)
+    return _Config(**overrides)
+
+
+# 导入时一次性读取环境变量；热路径（循环内读取配置）请在函数入口取一次 cfg = config.CONFIG 再用属性访问
+CONFIG = _load_config()
+
+# 兼容旧写法：config.SKIP_PHASE1 等模块级常量
+SKIP_PHASE1 = CONFIG.skip_phase1
+LOCAL_REGISTRY_PORT = CONFIG.local_registry_port
+DOWNLOAD_REGISTRY = CONFIG.download_registry
+NPM_PUBLIC_REGISTRY = CONFIG.npm_public_registry
+DOWNLOAD_TIMEOUT = CONFIG.download_timeout
+DOWNLOAD_CONCURRENCY = CONFIG.download_concurrency
+PARALLEL_DOWNLOADS = CONFIG.parallel_downloads
+RESOLVE_CACHE_TTL = CONFIG.resolve_cache_ttl
 
 # ===== 平台常量（无需修改） =====
 
-TOOLS_DIR = Path(__file__).resolve().parent
+TOOLS_DIR = Path(os.path.abspath(__file__)).parent  # abspath 为纯字符串拼接，不逐级 lstat
 BASE_DIR = TOOLS_DIR.parent  # 项目根目录（package.json 所在目录）
 IS_WIN = sys.platform == "win32"
 NPM = "npm.cmd" if IS_WIN else "npm"
@@ -38,15 +100,22 @@ CURL = "curl.exe" if IS_WIN else "curl"
 
 # ===== 控制台编码（无需修改） =====
 
+
+def _ensure_utf8_stream(stream):
+    """将控制台流设为 UTF-8 + 行缓冲；优先原地 reconfigure，避免重复 import 时层层包装。"""
+    if hasattr(stream, "reconfigure"):
+        stream.reconfigure(encoding="utf-8", errors="replace", line_buffering=True)
+        return stream
+    if (getattr(stream, "encoding", "") or "").lower().replace("-", "") == "utf8":
+        return stream
+    return io.TextIOWrapper(stream.buffer, encoding="utf-8", errors="replace", line_buffering=True)
+
+
 if IS_WIN:
     os.environ.setdefault("PYTHONIOENCODING", "utf-8")
     try:
-        sys.stdout = io.TextIOWrapper(
-            sys.stdout.buffer, encoding="utf-8", errors="replace", line_buffering=True,
-        )
-        sys.stderr = io.TextIOWrapper(
-            sys.stderr.buffer, encoding="utf-8", errors="replace", line_buffering=True,
-        )
+        sys.stdout = _ensure_utf8_stream(sys.stdout)
+        sys.stderr = _ensure_utf8_stream(sys.stderr)
     except Exception:
         pass
 else:
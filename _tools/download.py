@@ -5,10 +5,37 @@ from urllib.parse import urlparse, unquote
 import re
 import sys
 import time
+from typing import NamedTuple
 
 import aiohttp
 import yaml
 
+try:  # 可选依赖：orjson 解析大 lock 文件快数倍，未安装时回退到标准库 json
+    import orjson
+
+    def _load_json_file(f):
+        return orjson.loads(f.read())
+
+    def _loads_json_bytes(raw):
+        return orjson.loads(raw)
+except ImportError:
+    orjson = None
+
+    def _load_json_file(f):
+        return json.load(f)
+
+    def _loads_json_bytes(raw):
+        return json.loads(raw)
+
+# PyYAML 带 libyaml 时用 C 实现的 CSafeLoader，否则回退纯 Python 的 SafeLoader
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+try:  # 可选依赖：ijson 流式读取 lock 的 packages，超大 lock 峰值内存显著下降
+    import ijson
+except ImportError:
+    ijson = None
+
+import common
 import config
 
 
@@ -44,25 +71,69 @@ MAX_RETRIES = 3
 TIMEOUT = config.DOWNLOAD_TIMEOUT
 CONCURRENT_LIMIT = config.DOWNLOAD_CONCURRENCY
 CUSTOM_REGISTRY = config.DOWNLOAD_REGISTRY
+OFFICIAL_REGISTRY = "https://registry.npmjs.org"  # 镜像 404 或最后一次重试时回退的官方源
 DOWNLOAD_LOG = "logs/download.log"
+CHUNK_SIZE = 1024 * 1024  # 每次从响应读取的最大字节数；流式写盘，每个连接内存占用恒定
+# 与 npm/pacote 相同：优先请求精简版（corgi）packument，只含 versions/dist/dist-tags 等安装所需字段，
+# 不含每个版本的 README 等，体积通常小一个数量级；不支持的 registry 会回退返回完整 JSON
+PACKUMENT_HEADERS = {
+    "Accept": "application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8, */*",
+}
+DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0 Safari/537.36"
+}
 
 # ===== 工具函数 =====
+def _tarball_path(url):
+    """tarball URL 中 registry 之后的路径（如 /lodash/-/lodash-4.17.21.tgz），不含 query / fragment。
+    URL 以 CUSTOM_REGISTRY 开头时先去掉整个镜像前缀（镜像可能带路径，如 https://mirrors.cloud.tencent.com/npm），
+    否则按纯字符串切出 host 之后的 path（等价于 urlparse(url).path），免去构造 ParseResult。"""
+    prefix = CUSTOM_REGISTRY.rstrip("/") + "/"
+    if url.startswith(prefix):
+        path = url[len(prefix) - 1:]
+    else:
+        scheme_end = url.find("//")
+        host_end = url.find("/", scheme_end + 2 if scheme_end >= 0 else 0)
+        path = url[host_end:] if host_end >= 0 else "/"
+    for sep in ("?", "#"):
+        cut = path.find(sep)
+        if cut >= 0:
+            path = path[:cut]
+    return path
+
+
 def replace_registry(url, use_custom=True):
     """将 tarball URL 的源替换为配置的镜像。
     通过提取 URL 路径部分重建，兼容任何来源（npmjs / npmmirror / 本地 127.0.0.1 等）。"""
     if not use_custom or "/-/" not in url:
         return url
-    parsed = urlparse(url)
-    return CUSTOM_REGISTRY.rstrip("/") + parsed.path
+    return CUSTOM_REGISTRY.rstrip("/") + _tarball_path(url)
 
 # ===== 安全路径处理 =====
+_SANITIZE_TABLE = str.maketrans({c: '_' for c in '<>:"/\\|?*()@' + ''.join(map(chr, range(32)))})
+# /pkg/-/pkg-1.0.0(dep1)(dep2).tgz 末尾的嵌套括号段
+_TGZ_PAREN_RE = re.compile(r'(\([^()]*(?:\([^()]*\)[^()]*)*\))+\.tgz$')
+_BASE_PATH_RE = re.compile(r'^(/[^/]+/-/[^/]+-\d+\.\d+\.\d+)')
+# 文件名去掉 "包名-" 前缀后的版本部分，如 1.0.0(dep).tgz -> 1.0.0
+_VER_BEFORE_PAREN_RE = re.compile(r'([0-9]+\.[0-9]+\.[0-9]+[^()]*)\(')
+_VER_IN_FILE_RE = re.compile(r'.*?-(\d+\.\d+\.\d+[^()]*?)[\(\.]')
+# 文件名尾部版本号（与包名无关），如 pkg-1.0.0.tgz -> 1.0.0
+_VER_FROM_FILE_RE = re.compile(r'-([0-9]+\.[0-9]+\.[0-9]+[^)]*?)(\.tgz|$)')
+_NAME_VER_RE = re.compile(r'(.+?)-([0-9]+\.[0-9]+\.[0-9]+[^)]*?)(\.tgz|$)')
+# pnpm 版本号去掉括号内的 peer 后缀，如 1.0.0(react@18) -> 1.0.0
+_PNPM_VER_RE = re.compile(r'^([^()]+)')
+
+
 def sanitize_path(path):
     """将非法路径字符替换为安全字符"""
-    return re.sub(r'[<>:"/\\|?*\x00-\x1F()@]', '_', path)
+    return path.translate(_SANITIZE_TABLE)
 
 def clean_package_url(url):
     """清理URL中的嵌套依赖信息"""
     # 基本npm包URL格式: registry/name/-/name-version.tgz
+    # 绝大多数 URL 不含括号，先做字符串判断，免去 urlparse
+    if '(' not in url and ')' not in url:
+        return url
     parsed = urlparse(url)
     path = parsed.path
     
@@ -73,7 +144,7 @@ def clean_package_url(url):
     try:
         # 提取主要部分
         # 对于 /pkg/-/pkg-1.0.0(dep1)(dep2).tgz 提取成 /pkg/-/pkg-1.0.0.tgz
-        main_path = re.sub(r'(\([^()]*(?:\([^()]*\)[^()]*)*\))+\.tgz$', '.tgz', path)
+        main_path = _TGZ_PAREN_RE.sub('.tgz', path)
         
         # 如果清理失败，尝试更复杂的方法
         if '(' in main_path:
@@ -86,20 +157,22 @@ def clean_package_url(url):
                     if '(' in file_part:
                         # 提取版本号
                         pkg_name = scope_part.split('/')[-1]
-                        version_match = re.match(f'{pkg_name}-([0-9]+\\.[0-9]+\\.[0-9]+[^()]*)\\(', file_part)
+                        version_match = None
+                        if file_part.startswith(pkg_name + '-'):
+                            version_match = _VER_BEFORE_PAREN_RE.match(file_part, len(pkg_name) + 1)
                         if version_match:
                             version = version_match.group(1)
                             main_path = f"{scope_part}/-/{pkg_name}-{version}.tgz"
             else:
                 # 处理普通包 /pkg/-/pkg-1.0.0(...)
-                base_path_match = re.match(r'^(/[^/]+/-/[^/]+-\d+\.\d+\.\d+)', path)
+                base_path_match = _BASE_PATH_RE.match(path)
                 if base_path_match:
                     main_path = f"{base_path_match.group(1)}.tgz"
                 else:
                     # 最后尝试
                     pkg_path = path.split('/-/')[0] if '/-/' in path else ''
                     file_name = os.path.basename(path)
-                    version_match = re.match(r'.*?-(\d+\.\d+\.\d+[^()]*?)[\(\.]', file_name)
+                    version_match = _VER_IN_FILE_RE.match(file_name)
                     if version_match and pkg_path:
                         pkg_name = os.path.basename(pkg_path)
                         version = version_match.group(1)
@@ -132,109 +205,28 @@ def _npm_lock_resolved_names(lockfile_data):
     for pkg_path, pkg_info in lockfile_data['packages'].items():
         if not pkg_path or not isinstance(pkg_info, dict) or 'resolved' not in pkg_info:
             continue
-        # 取最后一段 node_modules/ 之后的部分作为包名
+        # 取最后一段 node_modules/ 之后的部分作为包名（rfind + 切片，不生成中间列表）
         # node_modules/a/node_modules/@scope/b -> @scope/b
-        parts = pkg_path.split('node_modules/')
-        name = parts[-1].strip('/') if parts else ''
+        idx = pkg_path.rfind('node_modules/')
+        name = (pkg_path[idx + 13:] if idx >= 0 else pkg_path).strip('/')
         if name:
             names.add(name)
     return names
 
 
-def _parse_version_tuple(version_str):
-    """将 4.6.7 或 4.6.7-beta.1 解析为 (4, 6, 7) 用于比较，预发布只取数字部分。"""
-    m = re.match(r'^(\d+)\.(\d+)\.(\d+)', str(version_str).strip())
-    if m:
-        return (int(m.group(1)), int(m.group(2)), int(m.group(3)))
-    return (0, 0, 0)
-
-
-def _version_satisfies_range(version_str, range_str):
-    """判断 version 是否满足 npm semver range。
-    支持: *, x, ^, ~, >=, >, <=, <, =, ||, 省略 minor/patch 简写(^4, >=2, 1.x)。
-    """
-    v = _parse_version_tuple(version_str)
-    range_str = (range_str or '').strip()
-
-    # 通配符
-    if not range_str or range_str in ('*', 'x', 'X', 'latest'):
-        return True
+# (registry, name) -> (versions 字典, 按版本降序排列的版本号列表)，同一包多个 range 只排序一次。
+# 与 _packument_tasks 同键、同为进程级；只有传入的正是排序时那份 versions 字典才复用，
+# 换了 registry 或 packument 被重新获取时按新字典重排，不会用到过期的列表
+_sorted_versions_cache = {}
 
-    # || 分隔：任一满足
-    if '||' in range_str:
-        return any(_version_satisfies_range(version_str, p.strip())
-                   for p in range_str.split('||'))
 
-    # 匹配一个条件: 可选前缀 + 主版本号[.次版本号[.补丁号]]
-    m = re.match(
-        r'^(\^|~|>=|>|<=|<|=)?\s*(\d+)(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?',
-        range_str,
-    )
-    if not m:
-        return False
-
-    prefix = m.group(1) or ''
-    major = int(m.group(2))
-    minor_raw, patch_raw = m.group(3), m.group(4)
-    has_minor = minor_raw is not None and minor_raw not in ('x', 'X', '*')
-    has_patch = patch_raw is not None and patch_raw not in ('x', 'X', '*')
-    minor = int(minor_raw) if has_minor else 0
-    patch = int(patch_raw) if has_patch else 0
-    b = (major, minor, patch)
-
-    def _ok():
-        if prefix == '^':
-            # ^major: >= major.0.0 < (major+1).0.0   (major > 0)
-            # ^0.minor: >= 0.minor.0 < 0.(minor+1).0 (minor > 0)
-            # ^0.0.patch: 精确匹配
-            if major > 0:
-                return v >= b and v[0] == major
-            if has_minor and minor > 0:
-                return v >= b and v[0] == 0 and v[1] == minor
-            if has_patch:
-                return v == b
-            return v[0] == major
-        if prefix == '~':
-            # ~major.minor[.patch]: >= b < major.(minor+1).0
-            # ~major: >= major.0.0 < (major+1).0.0
-            if has_minor:
-                return v >= b and v[0] == major and v[1] == minor
-            return v >= b and v[0] == major
-        if prefix == '>=':
-            return v >= b
-        if prefix == '>':
-            return v > b
-        if prefix == '<=':
-            return v <= b
-        if prefix == '<':
-            return v < b
-        if prefix == '=':
-            return v == b
-        # 无前缀
-        if not has_minor:
-            return v[0] == major          # "2" → 任意 2.x.x
-        if not has_patch:
-            return v[0] == major and v[1] == minor  # "1.2" → 任意 1.2.x
-        return v == b                     # 精确匹配
-
-    ok = _ok()
-    # 空格分隔的后续条件（如 ">=1 <3"）：全部满足
-    rest = range_str[m.end():].strip()
-    if rest and ok:
-        return _version_satisfies_range(version_str, rest)
-    return ok
-
-
-def _pick_best_version(versions_dict, range_str):
-    """从 versions 的 key 中选一个满足 range 的最高版本。"""
-    candidates = []
-    for ver in versions_dict:
-        if _version_satisfies_range(ver, range_str):
-            candidates.append((_parse_version_tuple(ver), ver))
-    if not candidates:
-        return None
-    candidates.sort(key=lambda x: x[0], reverse=True)
-    return candidates[0][1]
+def _sorted_versions_desc(registry, name, versions_dict):
+    key = (registry.rstrip('/'), name)
+    cached = _sorted_versions_cache.get(key)
+    if cached is None or cached[0] is not versions_dict:
+        cached = (versions_dict, sorted(versions_dict, key=common.version_sort_key, reverse=True))
+        _sorted_versions_cache[key] = cached
+    return cached[1]
 
 
 # ===== 从 lock 中收集“未带 resolved”的依赖（仅 npm lock v2/v3） =====
@@ -256,13 +248,17 @@ def collect_missing_peer_optional_from_lock(lockfile_data, existing_urls):
                 resolved_names.add(name)
         except Exception:
             pass
-    missing = []
-    seen = set()
-    # 同时检查 dependencies，避免因 lock 未包含某包 resolved 而漏下（如部分 npm/install 场景）
+    missing: dict = {}  # 有序去重
+    # lock v1/v2 同时检查 dependencies，避免因 lock 未包含某包 resolved 而漏下（如部分 npm/install 场景）；
+    # lock v3 中普通 dependencies 必有对应条目，只有 peer（如 --legacy-peer-deps 生成）与 optional 可能缺失
+    if (lockfile_data.get('lockfileVersion') or 1) >= 3:
+        dep_keys = ('peerDependencies', 'optionalDependencies')
+    else:
+        dep_keys = ('peerDependencies', 'optionalDependencies', 'dependencies')
     for pkg_path, pkg_info in lockfile_data['packages'].items():
         if not isinstance(pkg_info, dict):
             continue
-        for key in ('peerDependencies', 'optionalDependencies', 'dependencies'):
+        for key in dep_keys:
             deps = pkg_info.get(key)
             if not isinstance(deps, dict):
                 continue
@@ -272,29 +268,84 @@ def collect_missing_peer_optional_from_lock(lockfile_data, existing_urls):
                     continue
                 # lock 里 dependencies 的值可能是版本或 range 字符串
                 spec_str = (range_spec if isinstance(range_spec, str) else str(range_spec or 'latest')).strip()
-                spec = (dep_name, spec_str)
-                if spec in seen:
-                    continue
-                seen.add(spec)
-                missing.append(spec)
-    return missing
+                missing[(dep_name, spec_str)] = None
+    return list(missing)
+
+
+# 流式读取 lock 时每个 packages 条目只保留下载阶段用到的字段
+_LOCK_KEEP_KEYS = ('resolved', 'peerDependencies', 'optionalDependencies', 'dependencies')
+
+
+def load_npm_lock_slim(path):
+    """用 ijson 流式读取 package-lock.json 的 packages，条目只保留 _LOCK_KEEP_KEYS。
+    返回 {'packages': {...}}；lock v1（无 packages）返回 None，由调用方回退到完整解析。"""
+    packages = {}
+    with open(path, 'rb') as f:
+        # npm 把 lockfileVersion 写在文件开头，取到即停，不会读完整个文件
+        lockfile_version = next(ijson.items(f, 'lockfileVersion'), None)
+        f.seek(0)
+        for pkg_path, pkg_info in ijson.kvitems(f, 'packages'):
+            if isinstance(pkg_info, dict):
+                pkg_info = {k: pkg_info[k] for k in _LOCK_KEEP_KEYS if k in pkg_info}
+            packages[pkg_path] = pkg_info
+    if not packages:
+        return None
+    data = {'packages': packages}
+    if lockfile_version is not None:
+        data['lockfileVersion'] = int(lockfile_version)
+    return data
 
 
 # ===== 通过 registry 将 (name, range) 解析为 tarball URL =====
+async def fetch_packument(session, name, registry):
+    """请求 registry 包元数据（packument），失败返回 None。429/5xx 与网络错误按退避重试（优先 Retry-After）。"""
+    if name.startswith('@'):
+        scope, pkg_name = name.split('/', 1)
+        pkg_url = f"{registry}/{scope}%2F{pkg_name}"
+    else:
+        pkg_url = f"{registry}/{name}"
+    for attempt in range(MAX_RETRIES):
+        last = attempt >= MAX_RETRIES - 1
+        delay = None
+        try:
+            async with session.get(
+                pkg_url, timeout=aiohttp.ClientTimeout(total=15), headers=PACKUMENT_HEADERS,
+            ) as resp:
+                if resp.status == 200:
+                    # corgi 响应的 Content-Type 为 application/vnd.npm.install-v1+json，不做类型校验；
+                    # 直接解析原始 bytes（有 orjson 时用 orjson），不先解码成 str
+                    return _loads_json_bytes(await resp.read())
+                if last or not common.is_retryable_status(resp.status):
+                    return None
+                delay = common.retry_after_delay(resp.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if last:
+                return None
+        except Exception:
+            return None
+        await asyncio.sleep(common.backoff_delay(attempt) if delay is None else delay)
+    return None
+
+
+# (registry, name) -> 获取 packument 的任务；同一包的多个 range 共用一次请求
+_packument_tasks = {}
+
+
+def fetch_packument_cached(session, name, registry):
+    """fetch_packument 的按包名去重版本，返回可 await 的任务。"""
+    registry = registry.rstrip('/')
+    key = (registry, name)
+    task = _packument_tasks.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_packument(session, name, registry))
+        _packument_tasks[key] = task
+    return task
+
+
 async def resolve_spec_to_tarball_url(session, name, range_spec, registry):
     """请求 registry 包元数据，解析 range 得到具体版本，返回 tarball URL；失败返回 None。"""
-    registry = registry.rstrip('/')
-    try:
-        if name.startswith('@'):
-            scope, pkg_name = name.split('/', 1)
-            pkg_url = f"{registry}/{scope}%2F{pkg_name}"
-        else:
-            pkg_url = f"{registry}/{name}"
-        async with session.get(pkg_url, timeout=aiohttp.ClientTimeout(total=15)) as resp:
-            if resp.status != 200:
-                return None
-            data = await resp.json()
-    except Exception:
+    data = await fetch_packument_cached(session, name, registry)
+    if not isinstance(data, dict):
         return None
     versions = data.get('versions') or {}
     if not versions:
@@ -303,7 +354,14 @@ async def resolve_spec_to_tarball_url(session, name, range_spec, registry):
     if not range_str:
         # 无版本约束时，不下载（避免拉取不兼容的 latest 版本）
         return None
-    version = _pick_best_version(versions, range_str)
+    version = None
+    if range_str == 'latest':
+        # latest 按 npm 的定义取 dist-tags.latest（发布者可能把 latest 指向非最高版本），也省去排序与逐版本匹配
+        version = (data.get('dist-tags') or {}).get('latest')
+        if version not in versions:
+            version = None
+    if not version:
+        version = common.pick_best_version(versions, range_str, _sorted_versions_desc(registry, name, versions))
     if not version:
         # range 无法匹配任何已发布版本，放弃而非 fallback 到 latest（防止版本冲突）
         return None
@@ -316,32 +374,69 @@ async def resolve_spec_to_tarball_url(session, name, range_spec, registry):
     return replace_registry(tarball)
 
 
+# (registry, name, range) -> 解析任务；同一 spec 只发一次请求，后来者 await 同一个任务
+_spec_resolve_tasks = {}
+
+
+def resolve_spec_cached(session, name, range_spec, registry):
+    """resolve_spec_to_tarball_url 的去重版本，返回可 await 的任务。
+    asyncio 单线程下查字典与登记之间没有 await，无需额外加锁。"""
+    key = (registry.rstrip('/'), name, (range_spec or '').strip())
+    task = _spec_resolve_tasks.get(key)
+    if task is None:
+        task = asyncio.ensure_future(resolve_spec_to_tarball_url(session, name, range_spec, registry))
+        _spec_resolve_tasks[key] = task
+    return task
+
+
+async def resolve_specs_concurrently(session, specs, semaphore, registry):
+    """并发解析多个 (name, range)，并发数受 semaphore 限制；返回与 specs 顺序一致的 [(spec, url|None), ...]。"""
+    async def _one(name, range_spec):
+        async with semaphore:
+            return await resolve_spec_cached(session, name, range_spec, registry)
+
+    results = await asyncio.gather(*(_one(name, range_spec) for name, range_spec in specs), return_exceptions=True)
+    # 单个 spec 解析异常（如元数据结构异常）视为无法解析，不影响其余 spec
+    return [(spec, None if isinstance(r, Exception) else r) for spec, r in zip(specs, results)]
+
+
 # ===== 提取依赖函数 =====
+def _flat_npm_urls_from_packages(packages):
+    """lock v2/v3：packages 已是完整的扁平列表，单次遍历即可。"""
+    # 先用生成器筛出 http 的 resolved（跳过根包），再交给 set.update 批量加入，少一层 add_url_to_download 调用
+    candidates = (
+        pkg_info['resolved'] for pkg_path, pkg_info in packages.items()
+        if pkg_path != '' and isinstance(pkg_info, dict)
+        and isinstance(pkg_info.get('resolved'), str) and pkg_info['resolved'].startswith('http')
+    )
+    urls = set()
+    urls.update(clean_package_url(replace_registry(u)) for u in candidates)
+    return urls
+
+
 def extract_npm_urls(lockfile_data):
+    # 处理 package-lock.json v2/v3 (npm 7+) 格式；v2 里的 dependencies 与 packages 重复，无需再递归
+    if 'packages' in lockfile_data:
+        return list(_flat_npm_urls_from_packages(lockfile_data['packages']))
+
     urls = set()
 
-    def recurse_deps(deps, is_npm7=False):
+    def recurse_deps(deps):
         if not isinstance(deps, dict):
             return
             
         for name, info in deps.items():
             if isinstance(info, dict):
-                # 处理npm7+格式 (package-lock.json v2+)
-                if is_npm7 and 'resolved' in info:
-                    resolved_url = info['resolved']
-                    if resolved_url.startswith('http'):
-                        add_url_to_download(urls, replace_registry(resolved_url))
-                
                 # 处理常规依赖
                 if 'resolved' in info and info['resolved'].startswith('http'):
                     add_url_to_download(urls, replace_registry(info['resolved']))
                     
                 # 处理子依赖
                 if 'dependencies' in info:
-                    recurse_deps(info['dependencies'], is_npm7)
+                    recurse_deps(info['dependencies'])
                     
                 # 处理require节点
-                if 'requires' in info and not is_npm7:
+                if 'requires' in info:
                     # npm <= 6 有时会将依赖放在requires节点
                     for req_name, req_version in info['requires'].items():
                         # 尝试在父节点找resolved URL
@@ -349,29 +444,25 @@ def extract_npm_urls(lockfile_data):
                             if isinstance(parent_info, dict) and parent_name == req_name and 'resolved' in parent_info:
                                 add_url_to_download(urls, replace_registry(parent_info['resolved']))
 
-    # 处理 package-lock.json v2 (npm 7+) 格式
-    if 'packages' in lockfile_data:
-        is_npm7 = True
-        for pkg_path, pkg_info in lockfile_data['packages'].items():
-            if pkg_path == '':  # 跳过根包
-                continue
-                
-            if isinstance(pkg_info, dict) and 'resolved' in pkg_info:
-                resolved_url = pkg_info['resolved']
-                if resolved_url.startswith('http'):
-                    add_url_to_download(urls, replace_registry(resolved_url))
-
-    # 处理传统 package-lock.json 格式
+    # 处理传统 package-lock.json (v1) 格式
     if 'dependencies' in lockfile_data:
-        recurse_deps(lockfile_data['dependencies'], 'packages' in lockfile_data)
+        recurse_deps(lockfile_data['dependencies'])
         
     if 'devDependencies' in lockfile_data:
-        recurse_deps(lockfile_data['devDependencies'], 'packages' in lockfile_data)
+        recurse_deps(lockfile_data['devDependencies'])
     if 'optionalDependencies' in lockfile_data:
-        recurse_deps(lockfile_data['optionalDependencies'], 'packages' in lockfile_data)
+        recurse_deps(lockfile_data['optionalDependencies'])
         
     return list(urls)
 
+_LOCAL_SPEC_PREFIXES = ('link:', 'workspace:')
+
+
+def _is_local_spec(spec):
+    """spec 是否为 link:/workspace: 本地引用（不需要下载）。"""
+    return isinstance(spec, str) and spec.startswith(_LOCAL_SPEC_PREFIXES)
+
+
 def extract_pnpm_urls(lockfile_data):
     urls = set()
     workspace_packages = set()
@@ -380,7 +471,7 @@ def extract_pnpm_urls(lockfile_data):
     try:
         if os.path.exists('pnpm-workspace.yaml'):
             with open('pnpm-workspace.yaml', encoding='utf-8') as f:
-                workspace_data = yaml.safe_load(f)
+                workspace_data = yaml.load(f, Loader=_YamlLoader)
                 if workspace_data and 'packages' in workspace_data:
                     for pattern in workspace_data['packages']:
                         # 记录可能的工作区前缀
@@ -393,7 +484,7 @@ def extract_pnpm_urls(lockfile_data):
     # 判断是否为工作区包
     def is_workspace_package(pkg_name, version_info):
         # 直接检查版本是否为 workspace: 或 link: 开头
-        if isinstance(version_info, str) and (version_info.startswith('workspace:') or version_info.startswith('link:')):
+        if _is_local_spec(version_info):
             return True
             
         # 检查复杂对象的 specifier 和 version 字段
@@ -401,8 +492,7 @@ def extract_pnpm_urls(lockfile_data):
             specifier = version_info.get('specifier', '')
             version = version_info.get('version', '')
             
-            if (isinstance(specifier, str) and specifier.startswith('workspace:')) or \
-               (isinstance(version, str) and version.startswith('link:')):
+            if _is_local_spec(specifier) or _is_local_spec(version):
                 return True
                 
         return False
@@ -414,19 +504,11 @@ def extract_pnpm_urls(lockfile_data):
             add_url_to_download(urls, replace_registry(resolved))
             return True
             
-        # 跳过workspace packages和本地链接
-        if isinstance(version, str):
-            # 检查明确的workspace或link前缀
-            if version.startswith('link:') or version.startswith('workspace:'):
-                print(f"{emoji.get('⚠️')} 跳过工作区包：{pkg_name}@{version}")
-                return False
-                
-            # 检查包是否在工作区路径中
-            for workspace in workspace_packages:
-                if version.startswith(f"link:{workspace}/"):
-                    print(f"{emoji.get('⚠️')} 跳过工作区包：{pkg_name}@{version}")
-                    return False
-            
+        # 跳过workspace packages和本地链接（link:<工作区目录>/... 同样以 link: 开头）
+        if _is_local_spec(version):
+            print(f"{emoji.get('⚠️')} 跳过工作区包：{pkg_name}@{version}")
+            return False
+
         # 处理scoped包名 (@scope/package)
         if pkg_name.startswith('@'):
             try:
@@ -476,11 +558,11 @@ def extract_pnpm_urls(lockfile_data):
                     # 清理版本号中的括号内容
                     if isinstance(version, str):
                         # 跳过工作区链接
-                        if version.startswith('link:') or version.startswith('workspace:'):
+                        if _is_local_spec(version):
                             print(f"{emoji.get('⚠️')} 跳过工作区包：{pkg_name}@{version}")
                             continue
                             
-                        version_match = re.match(r'^([^()]+)', version)
+                        version_match = _PNPM_VER_RE.match(version)
                         if version_match:
                             version = version_match.group(1).strip()
                     add_package_url(pkg_name, version)
@@ -509,11 +591,11 @@ def extract_pnpm_urls(lockfile_data):
                     
             elif isinstance(info, str):
                 # 跳过工作区包
-                if info.startswith('workspace:') or info.startswith('link:'):
+                if _is_local_spec(info):
                     print(f"{emoji.get('⚠️')} 跳过工作区包：{pkg_name}@{info}")
                     continue
                 # 简单的版本字符串
-                version_match = re.match(r'^([^()]+)', info)
+                version_match = _PNPM_VER_RE.match(info)
                 version = version_match.group(1).strip() if version_match else info
                 add_package_url(pkg_name, version)
 
@@ -546,71 +628,44 @@ def extract_pnpm_urls(lockfile_data):
 
     return list(urls)
 
+# yarn.lock 以空行分隔条目；条目内两格缩进的 resolved/version/registry 字段一次扫出
+_YARN_BLOCK_RE = re.compile(r'\r?\n(?:[ \t]*\r?\n)+')
+_YARN_FIELDS_RE = re.compile(r'^ {2}"?(resolved|version|registry)"?\s+"([^"]+)"', re.M)
+_YARN_NAME_RE = re.compile(r'^(@?[a-zA-Z0-9._-]+(?:/[a-zA-Z0-9._-]+)?)')
+
+
 def extract_yarn_urls(lockfile_data):
     urls = set()
-    
-    # 匹配yarn.lock中的URL
-    resolved_pattern = re.compile(r'"resolved"\s+"(https?://[^"]+)"')
-    registry_pattern = re.compile(r'"registry"\s+"(https?://[^"]+)"')
-    version_pattern = re.compile(r'"version"\s+"([^"]+)"') 
-    name_pattern = re.compile(r'^([@a-zA-Z0-9_-]+(?:/[a-zA-Z0-9_-]+)?)')
-    
-    lines = lockfile_data.splitlines()
-    i = 0
-    
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # 检查是否为包声明行
-        if line and line.endswith(':'):
-            pkg_match = name_pattern.search(line)
-            if pkg_match:
-                pkg_name = pkg_match.group(1).strip('"\'')
-                
-                # 查找此包的version和resolved
-                resolved_url = None
-                version = None
-                j = i + 1
-                
-                # 扫描到下一个包声明前或文件结束
-                while j < len(lines) and not (lines[j].strip() and lines[j].strip().endswith(':')):
-                    resolved_match = resolved_pattern.search(lines[j])
-                    if resolved_match:
-                        resolved_url = resolved_match.group(1)
-                        if resolved_url.startswith('http'):
-                            add_url_to_download(urls, replace_registry(resolved_url))
-                            
-                    # 如果没有resolved但有version和registry，尝试构造URL
-                    if not resolved_url:
-                        version_match = version_pattern.search(lines[j])
-                        if version_match:
-                            version = version_match.group(1)
-                            
-                        registry_match = registry_pattern.search(lines[j])
-                        if registry_match and version:
-                            registry = registry_match.group(1).rstrip('/')
-                            # 构造可能的URL，正确处理作用域包
-                            if pkg_name.startswith('@'):
-                                scope, name = pkg_name.split('/', 1)
-                                potential_url = f"{registry}/{pkg_name}/-/{name}-{version}.tgz"
-                            else:
-                                potential_url = f"{registry}/{pkg_name}/-/{pkg_name}-{version}.tgz"
-                            add_url_to_download(urls, replace_registry(potential_url))
-                            
-                    j += 1
-                
-                # 如果版本号存在但没有resolved URL或registry，尝试使用默认registry
-                if version and not resolved_url:
-                    if pkg_name.startswith('@'):
-                        scope, name = pkg_name.split('/', 1)
-                        add_url_to_download(urls, f"{CUSTOM_REGISTRY}/{pkg_name}/-/{name}-{version}.tgz")
-                    else:
-                        add_url_to_download(urls, f"{CUSTOM_REGISTRY}/{pkg_name}/-/{pkg_name}-{version}.tgz")
-                
-                i = j - 1  # 调整主循环索引
-        
-        i += 1
-        
+
+    for block in _YARN_BLOCK_RE.split(lockfile_data):
+        # 条目声明行：首个非注释、无缩进、以冒号结尾的行
+        header = None
+        for line in block.splitlines():
+            if line and not line.startswith(('#', ' ', '\t')):
+                header = line.rstrip()
+                break
+        if not header or not header.endswith(':'):
+            continue
+        pkg_match = _YARN_NAME_RE.search(header.lstrip('"\''))
+        if not pkg_match:
+            continue
+        pkg_name = pkg_match.group(1)
+
+        fields = dict(_YARN_FIELDS_RE.findall(block))
+        resolved_url = fields.get('resolved')
+        if resolved_url and resolved_url.startswith('http'):
+            add_url_to_download(urls, replace_registry(resolved_url))
+            continue
+
+        version = fields.get('version')
+        if not version:
+            continue
+        # 没有 resolved 时用 registry 字段（或默认镜像）构造 URL，正确处理作用域包
+        registry = fields.get('registry', '')
+        registry = registry.rstrip('/') if registry.startswith('http') else CUSTOM_REGISTRY
+        short_name = pkg_name.split('/', 1)[1] if pkg_name.startswith('@') and '/' in pkg_name else pkg_name
+        add_url_to_download(urls, replace_registry(f"{registry}/{pkg_name}/-/{short_name}-{version}.tgz"))
+
     return list(urls)
 
 # ===== 提取包名和版本号 =====
@@ -628,22 +683,14 @@ def extract_package_info(url):
             
             # 提取版本号
             file_name = os.path.basename(path)
-            if pkg_part.startswith('@'):
-                # 作用域包 @scope/pkg
-                scope, name = pkg_part.split('/', 1)
-                version_match = re.search(f'{name}-([0-9]+\\.[0-9]+\\.[0-9]+[^)]*?)(\\.tgz|$)', file_name)
-            else:
-                # 普通包
-                name = pkg_part
-                version_match = re.search(f'{name}-([0-9]+\\.[0-9]+\\.[0-9]+[^)]*?)(\\.tgz|$)', file_name)
-                
+            version_match = _VER_FROM_FILE_RE.search(file_name)
             if version_match:
                 version = version_match.group(1)
                 return pkg_part, version
         
         # 备用方法：直接从文件名猜测
         file_name = os.path.basename(path)
-        name_version_match = re.match(r'(.+?)-([0-9]+\.[0-9]+\.[0-9]+[^)]*?)(\.tgz|$)', file_name)
+        name_version_match = _NAME_VER_RE.match(file_name)
         if name_version_match:
             name = name_version_match.group(1)
             version = name_version_match.group(2)
@@ -662,59 +709,129 @@ def extract_package_info(url):
     # 无法提取时返回文件名
     return os.path.basename(unquote(url)), "未知版本"
 
-# ===== 下载函数 =====
-async def download_file(session, url, semaphore):
-    """使用信号量限制并发下载数量"""
-    # 确保URL格式正确
+def _open_preallocated(file_path, length):
+    """以写方式打开目标文件；已知长度时先 posix_fallocate 一次性分配空间，减少逐块扩展带来的碎片。
+    不支持的平台/文件系统静默跳过。"""
+    f = open(file_path, 'wb')
+    if length > 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, length)
+        except OSError:
+            pass
+    return f
+
+
+def _finish_write(f):
+    # 截断到实际写入位置：Content-Length 与实际字节数不一致时不留尾部空洞
+    f.truncate()
+    f.close()
+
+
+def _list_downloaded(dir_path):
+    """一次 os.scandir 列出目录中已下载的文件名集合，代替逐个目标 os.stat。
+    已存在且非空即视为已下载：下载先写 .part 再改名，非空的目标文件一定是完整下载的。"""
+    names = set()
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and entry.stat().st_size > 0:
+                        names.add(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return names
+
+
+def _remove_quietly(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+# ===== 下载目标 =====
+class PackageTarget(NamedTuple):
+    """一次下载所需的全部 URL/文件名，在收集阶段算好，下载循环内不再解析 URL。"""
+    url: str           # 清理后的原始 URL（失败报告用）
+    mirror_url: str
+    official_url: str
+    file_name: str     # 已做安全字符替换的保存文件名
+
+
+def make_package_target(url):
+    """收集阶段一次性算出镜像/官方源 URL 与文件名。官方源按 tarball 路径重建（同 replace_registry），
+    不依赖原 URL 以 CUSTOM_REGISTRY 开头；非标准 tarball 路径则只用镜像地址。"""
     url = clean_package_url(url)
     mirror_url = replace_registry(url)
-    official_url = url.replace(CUSTOM_REGISTRY, "https://registry.npmjs.org")
+    # 官方源用原 URL 去掉镜像前缀后的 tarball 路径拼接，不能直接取镜像 URL 的 path（会带上镜像自身的路径前缀）
+    path = _tarball_path(url)
+    official_url = OFFICIAL_REGISTRY + path if '/-/' in path else mirror_url
+    file_name = sanitize_path(os.path.basename(unquote(path)))
+    return PackageTarget(url, mirror_url, official_url, file_name)
+
+
+# ===== 下载函数 =====
+async def download_file(session, target, semaphore):
+    """使用信号量限制并发下载数量。目标目录由 main() 预先创建。"""
+    url, mirror_url, official_url = target.url, target.mirror_url, target.official_url
+    # 确保文件名安全，直接保存到目标文件夹
+    file_path = os.path.join(PACKAGES_PATH, target.file_name)
+    part_path = file_path + '.part'  # 写完再改名，中断留下的半截文件不会被误当作已下载
 
     async with semaphore:  # 使用信号量控制并发
         for attempt in range(MAX_RETRIES):
             try:
                 current_url = mirror_url if attempt < MAX_RETRIES - 1 else official_url
-                parsed = urlparse(current_url)
-                file_name = os.path.basename(unquote(parsed.path))
-                # 确保文件名安全，直接保存到目标文件夹
-                safe_file_name = sanitize_path(file_name)
-                file_path = os.path.join(PACKAGES_PATH, safe_file_name)
-
-                # 确保目标目录存在
-                os.makedirs(PACKAGES_PATH, exist_ok=True)
 
-                headers = {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0 Safari/537.36"
-                }
-
-                async with session.get(current_url, timeout=TIMEOUT, headers=headers) as response:
+                async with session.get(current_url, timeout=TIMEOUT, headers=DOWNLOAD_HEADERS) as response:
                     response.raise_for_status()
-                    with open(file_path, 'wb') as f:
-                        while True:
-                            chunk = await response.content.read(8192)  # 增大读取块大小
-                            if not chunk:
-                                break
-                            f.write(chunk)
+                    # 磁盘写入放到线程池，避免阻塞事件循环拖慢其他并发下载
+                    loop = asyncio.get_running_loop()
+                    # 有 Content-Encoding 时 Content-Length 是压缩后长度，不能用于预分配
+                    length = 0 if response.headers.get('Content-Encoding') else (response.content_length or 0)
+                    f = await loop.run_in_executor(None, _open_preallocated, part_path, length)
+                    try:
+                        # 网络块通常远小于 CHUNK_SIZE：攒满 CHUNK_SIZE 才进一次线程池写盘，
+                        # 小 tarball 整个只写一次，不为每个小块付一次线程池调度
+                        buf = bytearray()
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            buf += chunk
+                            if len(buf) >= CHUNK_SIZE:
+                                data, buf = buf, bytearray()
+                                await loop.run_in_executor(None, f.write, data)
+                        if buf:
+                            await loop.run_in_executor(None, f.write, buf)
+                    finally:
+                        await loop.run_in_executor(None, _finish_write, f)
+                    os.replace(part_path, file_path)
 
                 return None
             except aiohttp.ClientResponseError as e:
-                if e.status == 404 and mirror_url != official_url:
-                    # 如果是404错误，立即尝试官方源
-                    print(f"{emoji.get('⚠️')} {mirror_url} 未找到, 尝试官方源 {official_url}")
+                if not common.is_retryable_status(e.status) and current_url != official_url:
+                    # 镜像返回 404 / 403 / 410 / 451 等不可重试的 4xx（未同步、被屏蔽或下架）：立即改试官方源，
+                    # 官方源也失败才算失败
+                    hint = "未找到" if e.status == 404 else f"返回 {e.status}"
+                    print(f"{emoji.get('⚠️')} {mirror_url} {hint}, 尝试官方源 {official_url}")
                     mirror_url = official_url
                     continue
-                elif attempt < MAX_RETRIES - 1:
-                    await asyncio.sleep(1)
+                elif common.is_retryable_status(e.status) and attempt < MAX_RETRIES - 1:
+                    # 服务端给了 Retry-After（限流/维护）时按它等待，否则指数退避
+                    delay = common.retry_after_delay(e.headers)
+                    await asyncio.sleep(common.backoff_delay(attempt) if delay is None else delay)
                 else:
                     print(f"{emoji.get('❌')} 下载失败 ({e.status}): {current_url}")
+                    _remove_quietly(part_path)
                     return (url, official_url, f"HTTP {e.status}")
             except Exception as e:
                 if attempt < MAX_RETRIES - 1:
                     print(f"{emoji.get('🔁')} 第 {attempt+1} 次失败，正在重试：{current_url}，错误: {str(e)[:100]}")
-                    await asyncio.sleep(1)
+                    await asyncio.sleep(common.backoff_delay(attempt))
                 else:
                     print(f"{emoji.get('❌')} 下载失败：{current_url} → 可尝试手动下载：{official_url}")
                     print(f"   错误信息: {str(e)[:100]}")
+                    _remove_quietly(part_path)
                     return (url, official_url, str(e)[:500])
 
 # ===== 主程序 =====
@@ -743,18 +860,22 @@ async def main():
     if os.path.exists('package-lock.json'):
         print(f"{emoji.get('✅')} 检测到 npm 锁文件 (package-lock.json)", flush=True)
         print("正在读取 package-lock.json（文件较大时可能需要几秒）...", flush=True)
+        lock_errors = (json.JSONDecodeError, ijson.JSONError) if ijson else json.JSONDecodeError
         try:
-            with open("package-lock.json", encoding='utf-8') as f:
-                data = json.load(f)
+            if ijson is not None:
+                data = load_npm_lock_slim("package-lock.json")
+            if data is None:
+                with open("package-lock.json", "rb") as f:
+                    data = _load_json_file(f)
             extract_func = extract_npm_urls
-        except json.JSONDecodeError:
+        except lock_errors:
             print(f"{emoji.get('❌')} package-lock.json 格式错误!")
             return
     elif os.path.exists('pnpm-lock.yaml'):
         print(f"{emoji.get('✅')} 检测到 pnpm 锁文件 (pnpm-lock.yaml)")
         try:
             with open("pnpm-lock.yaml", encoding='utf-8') as f:
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=_YamlLoader)
             extract_func = extract_pnpm_urls
         except yaml.YAMLError:
             print(f"{emoji.get('❌')} pnpm-lock.yaml 格式错误!")
@@ -793,7 +914,11 @@ async def main():
     # 创建信号量以限制并发下载数量
     semaphore = asyncio.Semaphore(CONCURRENT_LIMIT)
     timeout = aiohttp.ClientTimeout(total=TIMEOUT)
-    conn = aiohttp.TCPConnector(limit=CONCURRENT_LIMIT)
+    # 全部请求共用一个 session/connector：按 host 复用连接（空闲保活 75 秒），DNS 结果缓存 10 分钟
+    conn = aiohttp.TCPConnector(
+        limit=CONCURRENT_LIMIT, limit_per_host=CONCURRENT_LIMIT,
+        ttl_dns_cache=600, keepalive_timeout=75,
+    )
     
     print(f"{emoji.get('🔍')} 准备下载 {total_count} 个包...")
     print(f"{emoji.get('⏱️')} 开始下载...")
@@ -805,8 +930,8 @@ async def main():
         # 若有 lock 中缺失的 peer/optional，先向 registry 解析为 tarball URL 并合并
         if missing_specs:
             resolved_peer_urls = []
-            for name, range_spec in missing_specs:
-                u = await resolve_spec_to_tarball_url(session, name, range_spec, CUSTOM_REGISTRY)
+            resolved = await resolve_specs_concurrently(session, missing_specs, semaphore, CUSTOM_REGISTRY)
+            for (name, range_spec), u in resolved:
                 if u:
                     resolved_peer_urls.append(u)
                     print(f"{emoji.get('✅')} 解析 peer/optional: {name}@{range_spec} -> {u.split('/')[-1]}")
@@ -816,29 +941,36 @@ async def main():
                 unique_urls = sorted(set(unique_urls) | set(resolved_peer_urls))
                 total_count = len(unique_urls)
         
-        tasks = [download_file(session, url, semaphore) for url in unique_urls]
-        
-        # 分批处理任务并显示进度
+        # 已在 packages/ 中的包直接跳过：不建任务、不占信号量、不发请求，重复运行几乎瞬间完成
+        targets = [make_package_target(url) for url in unique_urls]
+        downloaded = _list_downloaded(PACKAGES_PATH)
+        to_fetch = [t for t in targets if t.file_name not in downloaded]
+        skipped_count = len(targets) - len(to_fetch)
+        if skipped_count:
+            print(f"{emoji.get('✅')} 已存在 {skipped_count} 个包，跳过下载")
+        total_count = len(to_fetch)
+
+        # 一次性提交全部任务，并发由 semaphore 控制；谁先完成先处理，不再按 10 个一批互相等待
+        tasks = [asyncio.create_task(download_file(session, t, semaphore)) for t in to_fetch]
+
         completed = 0
-        for i, batch in enumerate(range(0, len(tasks), 10)):
-            batch_tasks = tasks[batch:batch+10]
-            batch_results = await asyncio.gather(*batch_tasks)
-            
-            # 更新进度
-            completed += len(batch_tasks)
-            progress = (completed / total_count) * 100
-            print(f"进度: {completed}/{total_count} ({progress:.1f}%)")
-            
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            completed += 1
+            # 每 10 个或最后一个时更新进度
+            if completed % 10 == 0 or completed == total_count:
+                progress = (completed / total_count) * 100
+                print(f"进度: {completed}/{total_count} ({progress:.1f}%)")
+
             # 收集失败的下载 (url, official_url, error_info)
-            for result in batch_results:
-                if result is not None:
-                    failed_downloads.append(result)
+            if result is not None:
+                failed_downloads.append(result)
     
     end_time = asyncio.get_event_loop().time()
     duration = end_time - start_time
     
     success_count = total_count - len(failed_downloads)
-    percent = (success_count / total_count) * 100
+    percent = (success_count / total_count) * 100 if total_count else 100.0
 
     print(f"\n{emoji.get('📊')} 下载结果报告：")
     print(f"总共下载：{total_count} 个包")
@@ -849,22 +981,26 @@ async def main():
     log_dir = os.path.dirname(DOWNLOAD_LOG)
     if log_dir:
         os.makedirs(log_dir, exist_ok=True)
+    # 先拼好整份内容再一次性写入；无失败时写入空串，文件为空
+    log_parts = []
+    if failed_downloads:
+        log_parts.append(f"# 时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        log_parts.append(f"# 失败数: {len(failed_downloads)}\n\n")
+        formatted_failures = []
+        for item in failed_downloads:
+            url, official_url = item[0], item[1]
+            error_info = item[2] if len(item) >= 3 else "未知错误"
+            pkg_name, version = extract_package_info(url)
+            formatted_failures.append((pkg_name, version, official_url, error_info))
+        for pkg_name, version, url, error_info in sorted(formatted_failures, key=lambda x: x[0].lower()):
+            log_parts.append(
+                f"### {pkg_name}@{version}\n"
+                f"错误: {error_info}\n"
+                f"下载链接: {url}\n"
+                f"命令行: curl -L \"{url}\" -o \"{os.path.basename(url)}\"\n\n"
+            )
     with open(DOWNLOAD_LOG, "w", encoding="utf-8") as log_file:
-        if failed_downloads:
-            log_file.write(f"# 时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-            log_file.write(f"# 失败数: {len(failed_downloads)}\n\n")
-            formatted_failures = []
-            for item in failed_downloads:
-                url, official_url = item[0], item[1]
-                error_info = item[2] if len(item) >= 3 else "未知错误"
-                pkg_name, version = extract_package_info(url)
-                formatted_failures.append((pkg_name, version, official_url, error_info))
-            for pkg_name, version, url, error_info in sorted(formatted_failures, key=lambda x: x[0].lower()):
-                log_file.write(f"### {pkg_name}@{version}\n")
-                log_file.write(f"错误: {error_info}\n")
-                log_file.write(f"下载链接: {url}\n")
-                log_file.write(f"命令行: curl -L \"{url}\" -o \"{os.path.basename(url)}\"\n\n")
-        # 无失败时不写入任何内容，文件为空
+        log_file.write("".join(log_parts))
 
     if not failed_downloads:
         print(f"{emoji.get('🎉')} 全部下载成功！")
@@ -12,27 +12,66 @@ flow 只做衔接与子进程/文件编排，具体解析与下载由各阶段
 
 from __future__ import annotations
 
+import asyncio
 import json
+import mmap
 import os
 import re
 import shutil
 import sys
 import time
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Tuple
+from urllib.parse import urlsplit
 
 import requests
 
+import common
 import config
 import supplement
 
+try:  # 可选依赖：orjson 读写大 lock 文件快数倍且少一份 str 拷贝，未安装时回退到标准库 json
+    import orjson
+
+    def _loads_json_bytes(raw: bytes):
+        return orjson.loads(raw)
+
+    def _dumps_json_bytes(data) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+except ImportError:
+    orjson = None
+
+    def _loads_json_bytes(raw: bytes):
+        return json.loads(raw)
+
+    def _dumps_json_bytes(data) -> bytes:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
 # ================== 常量 ==================
 PYTHON = sys.executable
 BASE_DIR = config.BASE_DIR
 TOOLS_DIR = config.TOOLS_DIR
 MAX_FIX_ROUNDS = 200
 NPM_INSTALL_ARGS: List[str] = []  # 可追加如 "--legacy-peer-deps"
+RETRY_ATTEMPTS = 3       # 日志补下单个 URL 的最多尝试次数
+RETRY_DOWNLOAD_WORKERS = config.PARALLEL_DOWNLOADS  # 日志补下的并发线程数
+RESCAN_POLL_INTERVAL = 0.2   # 轮询本地 registry 重扫状态的间隔（秒）
+RESCAN_WAIT_TIMEOUT = 120.0  # 等待重扫完成的上限（秒）
+PIPE_READ_SIZE = 64 * 1024  # 读取子进程输出的块大小
+DOWNLOAD_COPY_BUFFER = 1024 * 1024  # 下载写盘时每次拷贝的字节数
+FLUSH_INTERVAL = 0.1  # 日志与终端回显的最短刷新间隔（秒）
+
+_RE_DL_LINK_BYTES = re.compile(r"下载链接:\s*(https?://\S+)".encode("utf-8"))
+# 文件名非法字符（含控制字符）统一替换为 _；str.translate 一次查表，与 download.py 的 _SANITIZE_TABLE 同法
+_SAFE_FN_TABLE = str.maketrans({c: "_" for c in '<>:"/\\|?*' + "".join(map(chr, range(32)))})
+
+
+# 与 supplement 共用同一个 Session / 连接池（两者池大小都取 config.PARALLEL_DOWNLOADS）：
+# 日志补下、进程内预补包、registry 重扫/轮询都复用同一批 keep-alive 连接
+SESSION = supplement.SESSION
 
 
 # ================== 下载日志重试 ==================
@@ -40,46 +79,123 @@ def _to_mirror_url(url: str) -> str:
     """将任意来源的 tarball URL 转为配置的镜像地址，确保重试使用加速源。"""
     if "/-/" not in url:
         return url
-    from urllib.parse import urlparse
-    parsed = urlparse(url)
-    return config.DOWNLOAD_REGISTRY.rstrip("/") + parsed.path
+    # 纯字符串切出 path（等价于 urlparse(url).path），与 download.replace_registry 一致
+    scheme_end = url.find("//")
+    host_end = url.find("/", scheme_end + 2 if scheme_end >= 0 else 0)
+    path = url[host_end:]
+    for sep in ("?", "#"):
+        cut = path.find(sep)
+        if cut >= 0:
+            path = path[:cut]
+    return config.DOWNLOAD_REGISTRY.rstrip("/") + path
+
+
+def _get_with_retry(url: str, timeout: int = 60, session: requests.Session | None = None) -> requests.Response:
+    """GET（stream）带指数退避重试：连接错误、超时、5xx/429 重试，其余 HTTP 错误（如 404）直接抛出。
+    502/503/504 已由共享 SESSION 的适配器先行重试，用尽后抛出的 requests.RetryError 不再在这里叠加重试；
+    连接错误与超时适配器不重试（见 supplement.SESSION），只在这里重试，最多 RETRY_ATTEMPTS 次。"""
+    get = (session or SESSION).get
+    attempt = 0
+    while True:
+        last = attempt >= RETRY_ATTEMPTS - 1
+        delay = None
+        try:
+            r = get(url, stream=True, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+        else:
+            if last or not common.is_retryable_status(r.status_code):
+                if not r.ok:
+                    # stream 响应：抛出前先关闭，连接及时归还共享连接池
+                    r.close()
+                    r.raise_for_status()
+                return r
+            r.close()
+            # 限流/维护时服务端给了 Retry-After 就按它等待
+            delay = common.retry_after_delay(r.headers)
+        time.sleep(common.backoff_delay(attempt) if delay is None else delay)
+        attempt += 1
+
+
+def _download_to(session: requests.Session, url: str, dst: Path) -> None:
+    """下载到 dst：先写 .part，完整写完再改名，失败不留半截文件。"""
+    part = dst.with_name(dst.name + ".part")
+    try:
+        with _get_with_retry(url, timeout=60, session=session) as r, part.open("wb") as f:
+            # 与 iter_content 一样按 Content-Encoding 解码；copyfileobj 在 C 层循环拷贝，省去逐块的 Python 循环
+            r.raw.decode_content = True
+            shutil.copyfileobj(r.raw, f, DOWNLOAD_COPY_BUFFER)
+        os.replace(part, dst)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+
+
+def _safe_filename_from_url(url: str) -> str:
+    """取 URL 路径最后一段作文件名（urlsplit 一次解析，去掉查询串/片段），替换非法字符并补 .tgz 后缀。"""
+    fn = urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1].translate(_SAFE_FN_TABLE)
+    return fn if fn.endswith(".tgz") else fn + ".tgz"
+
+
+def extract_failed_urls(log_path: Path) -> List[str]:
+    """从下载日志提取「下载链接:」后的 URL，按首次出现顺序去重。
+    mmap 后直接用 bytes 正则扫描，不把整份日志解码成 str；只解码命中的 URL（均为 ASCII）。"""
+    with log_path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # finditer 逐个产出，dict.fromkeys 按首次出现顺序去重，不先建完整的 findall 列表
+            return list(dict.fromkeys(
+                m.group(1).decode("ascii", errors="replace") for m in _RE_DL_LINK_BYTES.finditer(mm)
+            ))
 
 
 def retry_failed_from_log(log_path: Path, out_dir: Path):
-    """从下载日志中提取失败 URL，转为镜像地址后重新下载到 out_dir。"""
+    """从下载日志中提取失败 URL，转为镜像地址后并发重新下载到 out_dir（已存在的跳过）。"""
     if not log_path.exists():
         return
-    text = log_path.read_text(encoding="utf-8", errors="ignore")
-    raw_urls = list(dict.fromkeys(re.findall(r"下载链接:\s*(https?://\S+)", text)))
+    raw_urls = extract_failed_urls(log_path)
     if not raw_urls:
         return
     urls = [_to_mirror_url(u) for u in raw_urls]
     print(f"  从日志提取 {len(urls)} 条失败 URL，转为镜像地址后补下到 {out_dir} ...", flush=True)
     out_dir.mkdir(parents=True, exist_ok=True)
-    for url in urls:
-        fn = re.sub(r'[<>:"/\\|?*\x00-\x1F]', "_", url.split("?")[0].rstrip("/").split("/")[-1])
-        if not fn.endswith(".tgz"):
-            fn += ".tgz"
-        dst = out_dir / fn
-        if dst.exists() and dst.stat().st_size > 0:
-            continue
+    # 按目标文件去重（同名时后出现的 URL 生效）：不同 URL 映射到同一文件时只下载一次，也避免两个线程写同一路径
+    by_dst = {out_dir / _safe_filename_from_url(url): url for url in urls}
+    pending = [
+        (url, dst) for dst, url in by_dst.items()
+        if not (dst.exists() and dst.stat().st_size > 0)
+    ]
+    if not pending:
+        return
+
+    total = len(pending)
+    done = 0
+    lock = threading.Lock()
+
+    def job(url: str, dst: Path) -> None:
+        nonlocal done
         try:
-            r = requests.get(url, stream=True, timeout=60)
-            r.raise_for_status()
-            with dst.open("wb") as f:
-                for chunk in r.iter_content(chunk_size=256 * 1024):
-                    if chunk:
-                        f.write(chunk)
+            _download_to(SESSION, url, dst)
         except Exception as e:
             print(f"  跳过: {url[:60]}... {e}", flush=True)
+        with lock:
+            done += 1
+            if done % 10 == 0 or done == total:
+                print(f"  补下进度: {done}/{total}", flush=True)
+
+    with ThreadPoolExecutor(max_workers=min(RETRY_DOWNLOAD_WORKERS, total)) as ex:
+        for url, dst in pending:
+            ex.submit(job, url, dst)
 
 
 # ================== lock 重写 ==================
-def rewrite_lock_resolved_to_local(lock_path: Path, registry_url: str) -> None:
+def rewrite_lock_resolved_to_local(lock_path: Path, registry_url: str) -> bool:
     """将 package-lock.json 中所有 resolved 改为本地 registry URL。
-    同时移除无效幽灵条目（无 version/resolved/integrity 的空壳）。"""
+    同时移除无效幽灵条目（无 version/resolved/integrity 的空壳）。内容无变化时不写盘，返回是否写入。"""
     registry_url = registry_url.rstrip("/")
-    data = json.loads(lock_path.read_text(encoding="utf-8"))
+    data = _loads_json_bytes(lock_path.read_bytes())
     packages = data.get("packages") or {}
     phantom_keys = [
         key for key, pkg in packages.items()
@@ -93,53 +209,189 @@ def rewrite_lock_resolved_to_local(lock_path: Path, registry_url: str) -> None:
         del packages[key]
     if phantom_keys:
         print(f"  已移除 {len(phantom_keys)} 个无效幽灵条目。", flush=True)
+    dirty = False
     for key, pkg in packages.items():
         if not isinstance(pkg, dict) or key == "":
             continue
-        name = key.replace("\\", "/").split("node_modules/")[-1].strip("/")
         version = (pkg.get("version") or "").strip()
         if not version:
             continue
+        # 取最后一个 node_modules/ 之后的部分为包名（rpartition 单次扫描，不生成中间列表）
+        name = key.replace("\\", "/").rpartition("node_modules/")[2].strip("/")
         if name.startswith("@"):
-            if "/" not in name:
+            scope, sep, short = name.partition("/")
+            if not sep:
                 continue
-            path_part = name.replace("/", "%2F")
-            tarball_name = name.split("/", 1)[1] + f"-{version}.tgz"
+            new_url = f"{registry_url}/{scope}%2F{short}/-/{short}-{version}.tgz"
         else:
-            path_part = name
-            tarball_name = f"{name}-{version}.tgz"
-        pkg["resolved"] = f"{registry_url}/{path_part}/-/{tarball_name}"
-    lock_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+            new_url = f"{registry_url}/{name}/-/{name}-{version}.tgz"
+        if pkg.get("resolved") != new_url:
+            pkg["resolved"] = new_url
+            dirty = True
+    # resolved 已全部指向本地 registry 且无幽灵条目时不必重新序列化与写盘
+    if not dirty and not phantom_keys:
+        return False
+    # 先写临时文件再 os.replace：替换是原子的，且会断开与硬链接备份的关联，备份保持原内容
+    tmp_path = lock_path.with_suffix(".json.tmp")
+    tmp_path.write_bytes(_dumps_json_bytes(data))
+    os.replace(tmp_path, lock_path)
+    return True
 
 
 # ================== 命令执行 ==================
-def run_cmd_to_file(cmd: List[str], cwd: Path, log_path: Path, echo_stdout: bool = True) -> int:
-    """执行命令并实时写入日志文件。"""
+async def _run_cmd_to_file_async(cmd: List[str], cwd: Path, log_path: Path, echo_stdout: bool, on_line=None) -> int:
+    """按块（最多 PIPE_READ_SIZE 字节）读取子进程输出，原样写入日志；只有需要 on_line 时才按行切分并解码。"""
     log_path.parent.mkdir(parents=True, exist_ok=True)
-    with log_path.open("w", encoding="utf-8", errors="replace") as f:
-        f.write(f"# cmd: {' '.join(cmd)}\n# time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+    out = getattr(sys.stdout, "buffer", None) if echo_stdout else None
+    with log_path.open("wb") as f:
+        f.write(f"# cmd: {' '.join(cmd)}\n# time: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n".encode("utf-8"))
         f.flush()
-        p = subprocess.Popen(
-            cmd, cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-            shell=False, encoding="utf-8", errors="replace", bufsize=1
+        p = await asyncio.create_subprocess_exec(
+            *cmd, cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
         )
-        for line in iter(p.stdout.readline, ""):
-            f.write(line)
-            f.flush()
+        if out is not None:
+            sys.stdout.flush()
+        pending = b""
+        last_flush = time.monotonic()
+        while True:
+            buf = await p.stdout.read(PIPE_READ_SIZE)
+            if not buf:
+                break
+            f.write(buf)
             if echo_stdout:
-                print(line, end="")
-                sys.stdout.flush()
-        return p.wait()
+                if out is not None:
+                    out.write(buf)
+                else:
+                    print(buf.decode("utf-8", errors="replace"), end="")
+            # npm 每次只写一小段：按时间间隔刷新日志与终端，而不是每读一次就刷
+            now = time.monotonic()
+            if now - last_flush >= FLUSH_INTERVAL:
+                last_flush = now
+                f.flush()
+                if echo_stdout:
+                    sys.stdout.flush()
+                    if out is not None:
+                        out.flush()
+            if on_line is not None:
+                *lines, pending = (pending + buf).split(b"\n")
+                for line in lines:
+                    on_line(line.decode("utf-8", errors="replace") + "\n")
+        if on_line is not None and pending:
+            on_line(pending.decode("utf-8", errors="replace"))
+        if echo_stdout:
+            sys.stdout.flush()
+            if out is not None:
+                out.flush()
+        return await p.wait()
+
+
+async def _run_install_with_prefetch_async(
+    cmd: List[str], cwd: Path, log_path: Path, out_dir: Path, skip: set
+) -> Tuple[int, List[Tuple[str, str]]]:
+    queue: asyncio.Queue = asyncio.Queue()
+    found: dict = {}  # 有序去重：本次输出中出现的全部缺包
+    loop = asyncio.get_running_loop()
+
+    def on_line(line: str) -> None:
+        if not supplement.may_report_missing(line):
+            return
+        for spec in supplement.extract_404_from_text(line):
+            if spec not in found:
+                found[spec] = None
+                if spec not in skip:
+                    queue.put_nowait(spec)
+
+    async def prefetch_worker() -> None:
+        while True:
+            spec = await queue.get()
+            if spec is None:
+                return
+            try:
+                await loop.run_in_executor(
+                    None, supplement.download_tarballs_with_names, [spec], out_dir, cwd,
+                )
+            except Exception as e:
+                print(f"  预补包异常 {spec[0]}@{spec[1]}: {e}", flush=True)
+
+    worker = asyncio.ensure_future(prefetch_worker())
+    try:
+        code = await _run_cmd_to_file_async(cmd, cwd, log_path, False, on_line)
+    finally:
+        queue.put_nowait(None)
+        await worker
+    return code, list(found)
+
+
+def run_install_with_prefetch(
+    cmd: List[str], cwd: Path, log_path: Path, out_dir: Path, skip: set
+) -> Tuple[int, List[Tuple[str, str]]]:
+    """执行 npm install 并写日志；输出中一出现缺包（404 等）就在后台开始补包到 out_dir，
+    与 npm 剩余的执行时间重叠。skip 中的 (name, range) 视为已补过，不再预补。
+    返回前等待预补完成，随后的 supplement 轮次会把这些包视为「已存在」直接计入。
+    返回 (退出码, 缺包列表)：缺包在输出时逐行解析得到。写入日志的每一字节都经过逐行解析，
+    命令失败且没解析到缺包时不再整份日志重扫（结果只会相同），由调用方按退出码处理。"""
+    return asyncio.run(_run_install_with_prefetch_async(cmd, cwd, log_path, out_dir, skip))
+
+
+# ================== 本地 registry ==================
+def trigger_registry_rescan(port: int) -> int:
+    """通知本地 registry 重扫（服务端立即返回 202 并在后台扫描），轮询状态直到新索引生效，返回包版本数。
+    服务端报告扫描失败（status 的 error）时立即抛 RuntimeError，不等到超时。"""
+    base = f"http://127.0.0.1:{port}"
+    r = SESSION.get(f"{base}/-/rescan", timeout=5)
+    r.raise_for_status()
+    target = r.json()["target"]
+    deadline = time.monotonic() + RESCAN_WAIT_TIMEOUT
+    while True:
+        status = SESSION.get(f"{base}/-/rescan-status", timeout=5).json()
+        if status["generation"] >= target:
+            return status["packages"]
+        if status.get("error"):
+            raise RuntimeError(f"registry 重扫失败: {status['error']}")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"等待 registry 重扫超时（{RESCAN_WAIT_TIMEOUT:.0f}s）")
+        time.sleep(RESCAN_POLL_INTERVAL)
+
+
+# ================== 缺包过滤 ==================
+def _not_supplemented(missing: List[Tuple[str, str]], supplemented: set) -> List[Tuple[str, str]]:
+    """过滤掉本次运行已补过的缺包：名称与 range 去掉首尾空白后比较（与读回补包报告时的规整方式一致），
+    同时按首次出现顺序去重。"""
+    out: dict = {}
+    for n, r in missing:
+        spec = (n.strip(), r.strip())
+        if spec not in supplemented:
+            out[spec] = None
+    return list(out)
 
 
 # ================== 补包汇总日志 ==================
-def _write_supplement_total(path: Path, items: List[Tuple[str, str]], finished: bool = True):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    header = "# 本次补包列表\n" if finished else "# 本次补包列表（未完全解决）\n"
-    path.write_text(header + "\n".join(f"{n}@{r}" for n, r in items) + "\n", encoding="utf-8")
+def _append_supplement_total(log, path: Path, items: List[Tuple[str, str]]):
+    """把本轮补到的包追加到汇总日志并立即 flush：首次调用时以 "w" 打开（覆盖上次运行的列表）并写表头，
+    之后每轮只追加新条目，不再整体重写；中途中断时文件里也是截至上一轮的完整列表。返回打开的文件对象。"""
+    if log is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        log = open(path, "w", encoding="utf-8")
+        log.write("# 本次补包列表\n")
+    log.write("".join(f"{n}@{r}\n" for n, r in items))
+    log.flush()
+    return log
+
+
+def _finish_supplement_total(log, path: Path, finished: bool = True):
+    """结束汇总日志（未完全解决时追加一行标记），再从文件读回列表打印，无需在内存中保留全量列表。"""
+    if log is None:
+        return
+    if not finished:
+        log.write("# 未完全解决\n")
+    log.close()
+    items = [
+        s for s in path.read_text(encoding="utf-8").splitlines()
+        if s and not s.startswith("#")
+    ]
     print(f"本次补包共 {len(items)} 个，列表见 {path}", flush=True)
-    for n, r in items:
-        print(f"  - {n}@{r}", flush=True)
+    for line in items:
+        print(f"  - {line}", flush=True)
 
 
 # ================== 主流程 ==================
@@ -171,8 +423,19 @@ def main() -> int:
     lock_backup = BASE_DIR / "package-lock.json.backup_for_flow"
     lock_rewritten = False
     if lock_path.exists():
-        shutil.copy2(lock_path, lock_backup)
-        rewrite_lock_resolved_to_local(lock_path, registry_url)
+        # 备份用硬链接，不拷贝数据；重写时 os.replace 换新 inode，备份仍是原文件
+        linked = False
+        try:
+            if lock_backup.exists():
+                lock_backup.unlink()
+            os.link(lock_path, lock_backup)
+            linked = True
+        except OSError:
+            shutil.copy2(lock_path, lock_backup)
+        if not rewrite_lock_resolved_to_local(lock_path, registry_url) and linked:
+            # 未重写时 lock 与备份仍是同一 inode，npm 原地写 lock 会连带改掉备份，改为真实副本
+            lock_backup.unlink()
+            shutil.copy2(lock_path, lock_backup)
         lock_rewritten = True
         print("Step2: 已备份 lock 并将 resolved 重写为本地 registry。", flush=True)
 
@@ -187,39 +450,38 @@ def main() -> int:
     print(f"Step2: 本地 registry 已启动（{registry_url}）。", flush=True)
 
     supplemented_this_run: set[Tuple[str, str]] = set()
-    all_supplemented: List[Tuple[str, str]] = []
+    total_log = None  # 补包汇总日志，首次补到包时才创建
     npm_exe = config.NPM
     cmd_install = [npm_exe, "install", "--registry", registry_url, *NPM_INSTALL_ARGS]
 
     try:
         for round_idx in range(1, MAX_FIX_ROUNDS + 1):
             print(f"Step3 (round {round_idx}): npm install ...", flush=True)
-            code = run_cmd_to_file(cmd_install, BASE_DIR, npm_install_log, echo_stdout=False)
-
-            missing = supplement.extract_404_from_npm_install_log(npm_install_log)
+            code, missing = run_install_with_prefetch(
+                cmd_install, BASE_DIR, npm_install_log, packages_dir, supplemented_this_run,
+            )
             if not missing:
                 if code != 0:
                     print(f"npm install 失败（退出码 {code}），详见 {npm_install_log}。", flush=True)
                     return 1
                 print("npm install 成功，未检测到缺包。", flush=True)
-                if all_supplemented:
-                    _write_supplement_total(supplement_total_log, all_supplemented)
+                _finish_supplement_total(total_log, supplement_total_log)
                 return 0
 
-            new_missing = [(n, r) for (n, r) in missing if (n, r) not in supplemented_this_run]
+            new_missing = _not_supplemented(missing, supplemented_this_run)
             if not new_missing:
                 print("缺包均已补过，重试 npm install ...", flush=True)
-                code = run_cmd_to_file(cmd_install, BASE_DIR, npm_install_log, echo_stdout=False)
-                missing = supplement.extract_404_from_npm_install_log(npm_install_log)
+                code, missing = run_install_with_prefetch(
+                    cmd_install, BASE_DIR, npm_install_log, packages_dir, supplemented_this_run,
+                )
                 if not missing:
                     if code != 0:
                         print(f"npm install 失败（退出码 {code}），详见 {npm_install_log}。", flush=True)
                         return 1
                     print("npm install 成功，未检测到缺包。", flush=True)
-                    if all_supplemented:
-                        _write_supplement_total(supplement_total_log, all_supplemented)
+                    _finish_supplement_total(total_log, supplement_total_log)
                     return 0
-                new_missing = [(n, r) for (n, r) in missing if (n, r) not in supplemented_this_run]
+                new_missing = _not_supplemented(missing, supplemented_this_run)
             if not new_missing:
                 print("以下依赖已补包但安装仍报错，请检查 packages/ 或重试：", flush=True)
                 for n, r in missing:
@@ -245,33 +507,35 @@ def main() -> int:
                 s.strip() for s in supplement_round_log.read_text(encoding="utf-8").splitlines()
                 if s.strip()
             ]
+            round_supplemented = []
             for line in report_lines:
                 if "@" not in line:
                     continue
                 name, rng = line.rsplit("@", 1)
                 name, rng = name.strip(), rng.strip()
-                if name and rng:
+                # 只记首次补到的：汇总日志里同一包不会因跨轮再次出现而重复
+                if name and rng and (name, rng) not in supplemented_this_run:
                     supplemented_this_run.add((name, rng))
-                    all_supplemented.append((name, rng))
+                    round_supplemented.append((name, rng))
+            if round_supplemented:
+                total_log = _append_supplement_total(total_log, supplement_total_log, round_supplemented)
             if not report_lines:
                 print("未能补到任何 tarball，停止。", flush=True)
                 return 3
 
             try:
-                import urllib.request
-                urllib.request.urlopen(
-                    f"http://127.0.0.1:{local_registry_port}/-/rescan", timeout=10,
-                )
+                count = trigger_registry_rescan(local_registry_port)
             except Exception as e:
                 print(f"重新扫描 registry 失败: {e}", flush=True)
                 return 6
-            print("已重新扫描本地 registry，下一轮 npm install。", flush=True)
+            print(f"已重新扫描本地 registry（{count} 个包版本），下一轮 npm install。", flush=True)
 
         print(f"已达最大轮次 {MAX_FIX_ROUNDS}，仍有缺包，详见 {npm_install_log}", flush=True)
-        if all_supplemented:
-            _write_supplement_total(supplement_total_log, all_supplemented, finished=False)
+        _finish_supplement_total(total_log, supplement_total_log, finished=False)
         return 4
     finally:
+        if total_log is not None and not total_log.closed:
+            total_log.close()
         if local_server_proc is not None:
             try:
                 local_server_proc.terminate()
@@ -283,11 +547,15 @@ def main() -> int:
                     pass
             print("已停止本地 registry。", flush=True)
         if lock_rewritten and lock_backup.exists():
-            shutil.copy2(lock_backup, lock_path)
+            # 直接把备份换回原位，同时也删除了备份，无需再拷贝一次
             try:
-                lock_backup.unlink()
-            except Exception:
-                pass
+                os.replace(lock_backup, lock_path)
+            except OSError:
+                shutil.copy2(lock_backup, lock_path)
+                try:
+                    lock_backup.unlink()
+                except Exception:
+                    pass
             print("已恢复 package-lock.json。", flush=True)
 
 
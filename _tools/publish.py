@@ -7,16 +7,22 @@
 也可通过命令行 --base-url、--repository、--username、--password 覆盖。
 """
 
+import io
 import os
+import hashlib
 import re
 import sys
 import time
+import uuid
+import threading
 import argparse
 from pathlib import Path
-from urllib.parse import urlparse
+from urllib.parse import quote, urlparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import config  # noqa: F401
 
@@ -59,83 +65,275 @@ def parse_args():
 
 
 def collect_tgz_files(packages_path):
-    """收集目录下所有 .tgz 文件路径"""
-    path = Path(packages_path)
-    if not path.is_dir():
+    """递归收集目录下所有 .tgz 文件路径，按文件名排序。
+    os.scandir + 显式栈代替 glob("**/*.tgz")：不做通配匹配，只为命中的文件创建 Path。"""
+    if not os.path.isdir(packages_path):
         return []
-    return sorted(path.glob("**/*.tgz"), key=lambda p: p.name)
+    found = []
+    stack = [os.fspath(packages_path)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+                if entry.name.endswith(".tgz"):
+                    found.append((entry.name, entry.path))
+    found.sort()
+    return [Path(p) for _, p in found]
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.digest()
+
+
+def dedupe_by_content(files, sizes, workers):
+    """按内容去重：返回 (保留的文件, [(重复文件, 保留的同内容文件), ...])，保持 files 原有顺序。
+    只有大小相同的文件才可能内容相同，因此只对大小撞车的文件计算 sha256（线程池并行），其余不读内容。"""
+    by_size = {}
+    for fp in files:
+        by_size.setdefault(sizes[fp], []).append(fp)
+    candidates = [fp for group in by_size.values() if len(group) > 1 for fp in group]
+    if not candidates:
+        return files, []
+    with ThreadPoolExecutor(max_workers=min(workers, len(candidates))) as ex:
+        digests = dict(zip(candidates, ex.map(_file_sha256, candidates)))
+    kept_by_digest = {}
+    unique, dups = [], []
+    for fp in files:
+        digest = digests.get(fp)
+        if digest is not None:
+            kept = kept_by_digest.setdefault(digest, fp)
+            if kept is not fp:
+                dups.append((fp, kept))
+                continue
+        unique.append(fp)
+    return unique, dups
 
 
 # 从 .tgz 文件名解析包名与版本，如 lodash-4.17.21.tgz -> (lodash, 4.17.21)，@babel/core-7.0.0.tgz -> (@babel/core, 7.0.0)
-_TGZ_NAME_VERSION = re.compile(r"^(.+)-(\d+\.\d+\.\d+(?:[-.]\w+)*)\.tgz$", re.IGNORECASE)
+_TGZ_NAME_VERSION = re.compile(r"^(.+)-(\d+\.\d+\.\d+(?:[-.]\w+)*)\.tgz$")
 
 
 def parse_tgz_name(filename):
-    """返回 (name, version) 或 (None, None)。name 中的 %2f 会还原为 /。"""
-    m = _TGZ_NAME_VERSION.match(filename)
-    if not m:
-        return (None, None)
-    name = m.group(1).replace("%2f", "/").replace("%2F", "/")
-    return (name, m.group(2))
-
-
-def find_component_id(base_url, repository, auth, name, version, timeout):
-    """在仓库中按 name/version 查找组件 id，未找到返回 None。"""
+    """返回 (name, version) 或 (None, None)。name 中的 %2f 会还原为 /。
+    常见的 x.y.z 纯数字版本用 rpartition 直接切分，预发布等其余情况交给 _TGZ_NAME_VERSION。"""
+    name = version = None
+    if filename.endswith(".tgz"):
+        name_part, _, ver = filename[:-4].rpartition("-")
+        parts = ver.split(".")
+        if name_part and len(parts) == 3 and all(p.isdecimal() for p in parts):
+            name, version = name_part, ver
+    if name is None:
+        m = _TGZ_NAME_VERSION.match(filename)
+        if not m:
+            return (None, None)
+        name, version = m.group(1), m.group(2)
+    return (name.replace("%2f", "/").replace("%2F", "/"), version)
+
+
+def make_session(auth, workers):
+    """全程共用一个 Session：连接池大小与并发数一致，各线程复用 keep-alive 连接，省去每请求一次 TCP/TLS 握手。
+    GET/DELETE 遇 502/503/504 自动退避重试（POST 不重试，避免重复上传）。"""
+    session = requests.Session()
+    session.auth = auth
+    adapter = HTTPAdapter(
+        pool_connections=workers,
+        pool_maxsize=workers,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _fetch_components_page(session, url, params, timeout):
+    r = session.get(url, params=params, timeout=timeout)
+    if r.status_code != 200:
+        return None
+    return r.json()
+
+
+def iter_components(session, base_url, repository, timeout):
+    """按 continuationToken 逐页产出仓库组件。调用方处理第 N 页时，第 N+1 页已在后台线程中请求并解码，
+    翻页耗时与逐条匹配重叠。任一页非 200 即停止。"""
     url = f"{base_url.rstrip('/')}/service/rest/v1/components"
-    params = {"repository": repository}
-    while True:
-        r = requests.get(url, auth=auth, params=params, timeout=timeout)
-        if r.status_code != 200:
-            return None
-        data = r.json()
-        for item in data.get("items") or []:
-            n = (item.get("name") or "").strip()
-            g = (item.get("group") or "").strip()
-            if g:
-                n = f"{g}/{n}" if n else g
-            if n == name and (item.get("version") or "").strip() == version:
-                return item.get("id")
-        token = data.get("continuationToken")
-        if not token:
-            return None
-        params = {"repository": repository, "continuationToken": token}
-
-
-def delete_component(base_url, component_id, auth, timeout):
+    ex = ThreadPoolExecutor(max_workers=1)
+    try:
+        data = _fetch_components_page(session, url, {"repository": repository}, timeout)
+        while data is not None:
+            token = data.get("continuationToken")
+            nxt = None
+            if token:
+                params = {"repository": repository, "continuationToken": token}
+                nxt = ex.submit(_fetch_components_page, session, url, params, timeout)
+            yield from data.get("items") or []
+            data = nxt.result() if nxt else None
+    finally:
+        # 调用方提前结束（已找到）时不等待预取中的下一页
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def _component_key(item):
+    """组件条目 -> (name, version)，scoped 包的 name 拼回 @scope/name。"""
+    n = (item.get("name") or "").strip()
+    g = (item.get("group") or "").strip()
+    if g:
+        n = f"{g}/{n}" if n else g
+    return (n, (item.get("version") or "").strip())
+
+
+def find_component_id(session, base_url, repository, name, version, timeout):
+    """在仓库中按 name/version 查找组件 id，未找到返回 None。"""
+    for item in iter_components(session, base_url, repository, timeout):
+        if _component_key(item) == (name, version):
+            return item.get("id")
+    return None
+
+
+def search_component_id(session, base_url, repository, name, version, timeout):
+    """按坐标用 /v1/search 直接查组件 id，一次请求，不随仓库大小增长。
+    search 只按不含 scope 的 name 与 version 过滤，返回后再用 _component_key 精确比对（scope 由 group 区分）。
+    接口不可用或未命中返回 None，由调用方回退为翻页查找（search 索引可能略滞后于刚上传的组件）。"""
+    url = f"{base_url.rstrip('/')}/service/rest/v1/search"
+    params = {"repository": repository, "name": name.rpartition("/")[2], "version": version}
+    try:
+        while True:
+            data = _fetch_components_page(session, url, params, timeout)
+            if data is None:
+                return None
+            for item in data.get("items") or []:
+                if _component_key(item) == (name, version):
+                    return item.get("id")
+            token = data.get("continuationToken")
+            if not token:
+                return None
+            params = {**params, "continuationToken": token}
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def list_all_components(session, base_url, repository, timeout):
+    """完整翻页一次，返回 {(name, version): id}。"""
+    return {_component_key(item): item.get("id") for item in iter_components(session, base_url, repository, timeout)}
+
+
+class ComponentIndex:
+    """覆盖上传时 search 未命中后的兜底索引：第一次用到时才整体翻页建立（search 都命中时不发列表请求），
+    之后各线程 O(1) 查找，不再每个已存在的包都把组件列表翻一遍。
+    取出即删除：覆盖后组件 id 已变，旧条目不能再用；索引里没有的（如建立索引后才出现的）回退为单独翻页查找。"""
+
+    def __init__(self, session, base_url, repository, timeout):
+        self._args = (session, base_url, repository, timeout)
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def pop(self, name, version):
+        with self._lock:
+            if self._ids is None:
+                # 持锁建立：同时遇到冲突的其他线程等这一次翻页完成，而不是各自再翻一遍
+                self._ids = list_all_components(*self._args)
+            cid = self._ids.pop((name, version), None)
+        if cid is None:
+            session, base_url, repository, timeout = self._args
+            cid = find_component_id(session, base_url, repository, name, version, timeout)
+        return cid
+
+
+def delete_component(session, base_url, component_id, timeout):
     """删除指定 id 的组件，成功返回 True。"""
     url = f"{base_url.rstrip('/')}/service/rest/v1/components/{component_id}"
     try:
-        r = requests.delete(url, auth=auth, timeout=timeout)
+        r = session.delete(url, timeout=timeout)
         return r.status_code in (200, 204)
     except Exception:
         return False
 
 
-def upload_one(base_url, repository, auth, filepath, timeout):
+class _MultipartFileBody:
+    """单个 npm.asset 文件的 multipart/form-data 请求体，发送时按块从磁盘读取。
+    requests 的 files= 会先把整个文件编码进内存；这里只在内存中保留首尾两段分隔头，
+    并提供 __len__，让 requests 发送 Content-Length（而非 chunked），Nexus 照常按表单解析。"""
+
+    def __init__(self, field, filename, fileobj, size, content_type="application/gzip"):
+        boundary = uuid.uuid4().hex
+        head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self._length = len(head) + size + len(tail)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+
+def _post_asset(session, url, filepath, timeout):
+    """以流式 multipart 上传一个 .tgz，文件句柄在请求结束后关闭。"""
+    with open(filepath, "rb") as f:
+        body = _MultipartFileBody("npm.asset", filepath.name, f, os.fstat(f.fileno()).st_size)
+        return session.post(url, data=body, headers={"Content-Type": body.content_type}, timeout=timeout)
+
+
+def _upload_url(base_url, repository):
+    """上传地址只依赖 (base_url, repository)，由 main 拼一次后传给每个 upload_one；仓库名做 URL 编码。"""
+    return f"{base_url.rstrip('/')}/service/rest/v1/components?repository={quote(repository, safe='')}"
+
+
+def upload_one(session, base_url, repository, upload_url, filepath, timeout, components=None):
     """
     上传单个 .tgz，已存在则先删后传（覆盖）。返回 (filename, 'success'|'overwritten'|'failure', message)。
+    覆盖时先用 search 按坐标查组件 id；未命中再查共享的 ComponentIndex（components），不传时单独翻页查找。
+    upload_url 为 _upload_url(base_url, repository) 预先拼好的上传地址。
     """
-    url = f"{base_url.rstrip('/')}/service/rest/v1/components?repository={repository}"
     filename = filepath.name
-    name, version = parse_tgz_name(filename)
 
     try:
-        with open(filepath, "rb") as f:
-            files = {"npm.asset": (filename, f, "application/gzip")}
-            r = requests.post(url, auth=auth, files=files, timeout=timeout)
+        r = _post_asset(session, upload_url, filepath, timeout)
         if r.status_code in (200, 201, 204):
             return (filename, "success", None)
         if r.status_code == 400 and "does not allow updating" in (r.text or ""):
+            # 只有覆盖时才需要包名与版本，首次上传成功的文件不做解析
+            name, version = parse_tgz_name(filename)
             if not name or not version:
                 return (filename, "failure", "already exists, cannot parse name/version for overwrite")
-            cid = find_component_id(base_url, repository, auth, name, version, timeout)
+            cid = search_component_id(session, base_url, repository, name, version, timeout)
+            if not cid:
+                if components is not None:
+                    cid = components.pop(name, version)
+                else:
+                    cid = find_component_id(session, base_url, repository, name, version, timeout)
             if not cid:
                 return (filename, "failure", "already exists, component id not found for overwrite")
-            if not delete_component(base_url, cid, auth, timeout):
+            if not delete_component(session, base_url, cid, timeout):
                 return (filename, "failure", "already exists, delete failed for overwrite")
-            with open(filepath, "rb") as f2:
-                files2 = {"npm.asset": (filename, f2, "application/gzip")}
-                r2 = requests.post(url, auth=auth, files=files2, timeout=timeout)
+            r2 = _post_asset(session, upload_url, filepath, timeout)
             if r2.status_code in (200, 201, 204):
                 return (filename, "overwritten", None)
             return (filename, "failure", f"overwrite re-upload HTTP {r2.status_code} {r2.text[:200]}")
@@ -159,6 +357,11 @@ def main():
         print(f"在 {packages_path} 下未找到任何 .tgz 文件")
         return
 
+    sizes = {fp: fp.stat().st_size for fp in files}
+    # 大文件先传：小文件填补末尾，不会剩一个大文件单独拖长总耗时；同样大小保持按文件名的顺序（sort 稳定）
+    files.sort(key=sizes.__getitem__, reverse=True)
+    # 内容完全相同的 tarball（如不同子目录里的同一个包）只传一次，否则后一个会触发多余的删后重传
+    files, duplicates = dedupe_by_content(files, sizes, args.workers)
     total = len(files)
     print("============================================")
     print("  Nexus npm 包批量上传（全部覆盖）")
@@ -167,6 +370,8 @@ def main():
     print(f"  仓库: {repo}")
     print(f"  包数: {total}")
     print(f"  并发: {args.workers}")
+    if duplicates:
+        print(f"  重复: {len(duplicates)}（内容相同，已跳过）")
     print("============================================\n")
 
     os.makedirs(os.path.dirname(UPLOAD_LOG) or ".", exist_ok=True)
@@ -183,13 +388,24 @@ def main():
 
     t0 = time.time()
     done = 0
+    # 进度条最多刷新约 200 次（每次都是一次终端写），循环结束后再打印最终状态
+    update_every = max(1, total // 200)
 
-    with open(UPLOAD_LOG, "w", encoding="utf-8") as log:
+    # 1 MiB 缓冲：逐条结果只进内存缓冲，攒满或结束时才真正写盘
+    with open(UPLOAD_LOG, "w", encoding="utf-8", buffering=1 << 20) as log:
         log.write(f"# Nexus npm 上传日志（全部覆盖）\n# 时间: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
         log.write(f"# 地址: {base_url}\n# 仓库: {repo}\n# 总数: {total}\n\n")
-
-        with ThreadPoolExecutor(max_workers=args.workers) as ex:
-            futures = {ex.submit(upload_one, base_url, repo, auth, fp, TIMEOUT): fp for fp in files}
+        for fp, kept in duplicates:
+            log.write(f"DUP  {fp}  same as {kept}\n")
+
+        session = make_session(auth, args.workers)
+        with session, ThreadPoolExecutor(max_workers=args.workers) as ex:
+            components = ComponentIndex(session, base_url, repo, TIMEOUT)
+            upload_url = _upload_url(base_url, repo)
+            futures = {
+                ex.submit(upload_one, session, base_url, repo, upload_url, fp, TIMEOUT, components): fp
+                for fp in files
+            }
             for f in as_completed(futures):
                 filename, status, msg = f.result()
                 done += 1
@@ -202,7 +418,8 @@ def main():
                 else:
                     failed.append((filename, msg))
                     log.write(f"FAIL {filename}  {msg}\n")
-                print(progress_bar(done, total, success_count, overwritten_count, len(failed)), end="", flush=True)
+                if done % update_every == 0:
+                    print(progress_bar(done, total, success_count, overwritten_count, len(failed)), end="", flush=True)
 
     elapsed = time.time() - t0
     print(progress_bar(total, total, success_count, overwritten_count, len(failed)))
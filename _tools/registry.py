@@ -14,16 +14,50 @@
    启动后在项目根执行：npm install --registry http://127.0.0.1:4874
 """
 
+import asyncio
 import json
+import os
 import re
 import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import unquote
-from http.server import HTTPServer, BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from aiohttp import web
 
 import config  # noqa: F401
 
-_TGZ_NAME_VERSION = re.compile(r"^(.+)-(\d+\.\d+\.\d+(?:[-.]\w+)*)\.tgz$", re.IGNORECASE)
+PACKUMENT_CACHE_SIZE = 4096  # 超过即整体清空，避免无界增长
+
+# 不加 IGNORECASE：扫描 / 收集时已按小写 ".tgz" 后缀过滤，包名中的大小写已由 \w 与 .+ 覆盖
+_TGZ_NAME_VERSION = re.compile(r"^(.+)-(\d+\.\d+\.\d+(?:[-.]\w+)*)\.tgz$")
+
+
+def tarball_version(tarball_name: str):
+    """从 tarball 文件名取版本号，不合法返回 None。
+    常见的 x.y.z 纯数字版本走 rpartition 快速路径，预发布等其余情况交给 _TGZ_NAME_VERSION。"""
+    if tarball_name.endswith(".tgz"):
+        name_part, _, ver = tarball_name[:-4].rpartition("-")
+        parts = ver.split(".")
+        if name_part and len(parts) == 3 and all(p.isdigit() for p in parts):
+            return ver
+    m = _TGZ_NAME_VERSION.match(tarball_name)
+    return m.group(2) if m else None
+
+
+def version_sort_key(version: str) -> tuple:
+    """semver 排序键：先比 major.minor.patch，同号时正式版大于预发布版；
+    预发布标识逐段比较，数字段按数值且小于字母段（7.29.0-alpha.2 < 7.29.0-alpha.10 < 7.29.0）。"""
+    core, sep, pre = version.partition("-")
+    nums = []
+    for part in core.split(".")[:3]:
+        nums.append(int(part) if part.isdigit() else 0)
+    nums += [0] * (3 - len(nums))
+    if not sep:
+        return (*nums, 1, ())
+    ids = tuple((0, int(p), "") if p.isdigit() else (1, 0, p) for p in pre.split("."))
+    return (*nums, 0, ids)
 
 
 def parse_tgz_name(filename: str) -> tuple:
@@ -35,26 +69,57 @@ def parse_tgz_name(filename: str) -> tuple:
 
 
 def scan_packages_dir(root: Path) -> dict:
+    """递归收集 root 下的 .tgz。os.scandir + 显式栈代替 glob，先按后缀过滤再做正则解析。"""
     index = {}
     if not root.is_dir():
         return index
-    for fp in root.glob("**/*.tgz"):
-        name, ver = parse_tgz_name(fp.name)
-        if name and ver:
-            index[(name, ver)] = fp
+    stack = [str(root)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+                if entry.name.endswith(".tgz"):
+                    name, ver = parse_tgz_name(entry.name)
+                    if name and ver:
+                        index[(name, ver)] = Path(entry.path)
     return index
 
 
-def build_packument(index: dict, base_url: str, package_name: str) -> dict:
+def build_name_index(index: dict) -> dict:
+    """按小写包名分组：{name_lower: [(version, path), ...]}，查询时只看该包自己的版本。"""
+    by_name = defaultdict(list)
+    for (n, v), path in index.items():
+        by_name[(n or "").lower()].append((v, path))
+    # 转回普通 dict：查询只用 .get，避免 defaultdict 在误用 [] 时悄悄插入空项
+    return dict(by_name)
+
+
+def _candidate_entries(name_index: dict, package_name: str) -> list:
+    """包名匹配忽略大小写；scoped 包同时匹配完整名与后半段名（如 pro-field）。后半段名在前，完整名优先覆盖。"""
+    package_name_lower = package_name.lower()
+    entries = []
+    if package_name.startswith("@") and "/" in package_name:
+        unscoped_lower = package_name.split("/", 1)[1].lower()
+        if unscoped_lower != package_name_lower:
+            entries.extend(name_index.get(unscoped_lower, ()))
+    entries.extend(name_index.get(package_name_lower, ()))
+    return entries
+
+
+def build_packument(name_index: dict, base_url: str, package_name: str) -> dict:
     """构建 packument；包名匹配忽略大小写；scoped 包同时匹配完整名与后半段名（如 pro-field）。"""
     package_name = (package_name or "").replace("%2F", "/").replace("%2f", "/")
-    package_name_lower = package_name.lower()
-    unscoped_lower = package_name.split("/", 1)[1].lower() if package_name.startswith("@") and "/" in package_name else None
     versions = {}
-    for (n, v), path in index.items():
-        n_lower = (n or "").lower()
-        if n_lower != package_name_lower and (unscoped_lower is None or n_lower != unscoped_lower):
-            continue
+    for v, path in _candidate_entries(name_index, package_name):
         if package_name.startswith("@"):
             rest = package_name.split("/", 1)[1]
             tarball_name = f"{rest}-{v}.tgz"
@@ -71,11 +136,10 @@ def build_packument(index: dict, base_url: str, package_name: str) -> dict:
         }
     if not versions:
         return {}
-    # 给一个最基本的 dist-tags，避免部分 npm 逻辑拿不到 latest
-    try:
-        latest = sorted(versions.keys())[-1]
-    except Exception:
-        latest = next(iter(versions.keys()))
+    # 给一个最基本的 dist-tags，避免部分 npm 逻辑拿不到 latest；按 semver 取最大（有正式版时不取预发布），
+    # 避免字符串比较把 4.9.0 排在 4.17.0 之后
+    releases = [v for v in versions if "-" not in v]
+    latest = max(releases or versions, key=version_sort_key)
     # 顶层 version 为 latest，避免 npm 报 Invalid Version:（空）
     if not latest:
         return {}
@@ -87,95 +151,142 @@ def build_packument(index: dict, base_url: str, package_name: str) -> dict:
     }
 
 
-class LocalRegistryHandler(BaseHTTPRequestHandler):
-    protocol_version = "HTTP/1.1"
+def scan_roots(roots) -> dict:
+    """合并多个目录的索引，后面的目录覆盖前面的同名同版本。多个目录在线程池中并行扫描（以 I/O 为主）。"""
+    index = {}
+    if len(roots) <= 1:
+        for root in roots:
+            index.update(scan_packages_dir(root))
+        return index
+    with ThreadPoolExecutor(max_workers=min(len(roots), 8)) as ex:
+        # map 按输入顺序返回，保持「后面的目录覆盖前面」的语义
+        for sub in ex.map(scan_packages_dir, roots):
+            index.update(sub)
+    return index
 
-    def log_message(self, format, *args):
-        pass
 
-    def do_GET(self):
-        path = unquote(self.path).split("?")[0].strip("/")
-        index = self.server.package_index  # type: ignore
-        base_url = self.server.base_url  # type: ignore
-
-        # 重新扫描 packages 目录，使新下载的包生效（无需重启进程）
-        if path == "-/rescan":
-            roots = getattr(self.server, "package_roots", [])  # type: ignore
-            new_index = {}
-            for root in roots:
-                if root.is_dir():
-                    for k, v in scan_packages_dir(root).items():
-                        new_index[k] = v
-            self.server.package_index = new_index  # type: ignore
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(f"rescan ok, {len(new_index)} packages\n".encode("utf-8"))
-            return
-
-        parts = path.split("/-/", 1)
-        if len(parts) == 2:
-            prefix, tarball_name = parts[0].strip("/"), parts[1].strip()
-            package_name = prefix.replace("%2F", "/").replace("%2f", "/")
-            m = re.match(r"^(.+)-(\d+\.\d+\.\d+(?:[-.]\w+)*)\.tgz$", tarball_name, re.I)
-            if m:
-                ver = m.group(2)
-                # 包名匹配忽略大小写；scoped 包同时匹配完整名与后半段名
-                want_lower = package_name.lower()
-                want_unscoped = package_name.split("/", 1)[1].lower() if package_name.startswith("@") and "/" in package_name else None
-                filepath = None
-                for (n, v), fp in index.items():
-                    n_lower = (n or "").lower()
-                    if v != ver:
-                        continue
-                    if n_lower == want_lower or (want_unscoped is not None and n_lower == want_unscoped):
-                        filepath = fp
-                        break
-                if filepath is not None and filepath.exists():
-                    self.send_response(200)
-                    self.send_header("Content-Type", "application/gzip")
-                    self.send_header("Content-Length", str(filepath.stat().st_size))
-                    self.end_headers()
-                    try:
-                        with filepath.open("rb") as f:
-                            while True:
-                                chunk = f.read(1024 * 256)
-                                if not chunk:
-                                    break
-                                self.wfile.write(chunk)
-                    except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
-                        return
-                    return
-            self.send_error(404)
-            return
-
-        package_name = path.replace("%2F", "/").replace("%2f", "/").strip()
-        if not package_name:
-            self.send_error(404)
-            return
-        pack = build_packument(index, base_url, package_name)
-        if not pack:
-            self.send_error(404)
-            return
-        body = json.dumps(pack).encode("utf-8")
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", str(len(body)))
-        self.end_headers()
-        self.wfile.write(body)
-        return
-
-    def do_HEAD(self):
-        self.do_GET()
-
-class QuietThreadingHTTPServer(ThreadingHTTPServer):
-    """屏蔽客户端中途断开导致的噪声堆栈（npm 并发/取消请求时很常见）。"""
-
-    def handle_error(self, request, client_address):  # pragma: no cover
-        exc_type, _, _ = sys.exc_info()
-        if exc_type in (ConnectionResetError, ConnectionAbortedError, BrokenPipeError):
-            return
-        return super().handle_error(request, client_address)
+def _normalize_name(raw: str) -> str:
+    return raw.replace("%2F", "/").replace("%2f", "/").strip("/").strip()
+
+
+async def _rescan_loop(state: dict) -> None:
+    """后台重扫：扫描在线程池中执行，不阻塞事件循环；扫描期间收到的新请求合并为再扫一轮。
+    扫描抛异常时记入 state["rescan_error"] 并结束任务（代数不再前进），由 /-/rescan-status 返回给客户端。"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # 扫描真正开始时才清除待扫标记：任务创建后、首轮开始前到达的请求都由这一轮覆盖
+            state["rescan_pending"] = False
+            state["rescan_scanning"] = True
+            try:
+                new_index = await loop.run_in_executor(None, scan_roots, state["package_roots"])
+            except Exception as e:
+                state["rescan_error"] = f"{type(e).__name__}: {e}"
+                print(f"重扫失败: {state['rescan_error']}", file=sys.stderr, flush=True)
+                break
+            finally:
+                state["rescan_scanning"] = False
+            # 单线程事件循环：索引、代数、缓存在同一步内替换，无需加锁；扫描期间读者继续用旧索引
+            state["package_index"] = new_index
+            state["name_index"] = build_name_index(new_index)
+            state["index_generation"] += 1
+            state["packument_cache"] = {}
+            if not state["rescan_pending"]:
+                break
+    finally:
+        state["rescan_task"] = None
+
+
+def _rescan_status(state: dict, **extra) -> dict:
+    return {
+        "generation": state["index_generation"],
+        "running": state["rescan_task"] is not None,
+        "error": state["rescan_error"],
+        "packages": len(state["package_index"]),
+        **extra,
+    }
+
+
+async def handle_rescan(request):
+    """重新扫描 packages 目录，使新下载的包生效（无需重启进程）。立即返回 202，
+    响应中的 target 为本次请求生效后的索引代数，客户端轮询 /-/rescan-status 直到 generation >= target；
+    error 非空表示后台扫描失败、不会再达到 target。"""
+    state = request.app["state"]
+    if state["rescan_task"] is None:
+        target = state["index_generation"] + 1
+        # 新任务开始：上一个任务的失败原因作废，error 只反映最近一次结束的任务
+        state["rescan_error"] = None
+        state["rescan_task"] = asyncio.get_running_loop().create_task(_rescan_loop(state))
+    elif not state["rescan_scanning"]:
+        # 任务已创建但这一轮尚未开始扫描：它一定能看到此前写入的文件
+        target = state["index_generation"] + 1
+    else:
+        # 正在扫描的一轮可能看不到刚写入的文件，标记后由后台任务再扫一轮
+        target = state["index_generation"] + 2
+        state["rescan_pending"] = True
+    return web.json_response(_rescan_status(state, target=target), status=202)
+
+
+async def handle_rescan_status(request):
+    return web.json_response(_rescan_status(request.app["state"]))
+
+
+async def handle_tarball(request):
+    state = request.app["state"]
+    package_name = _normalize_name(unquote(request.match_info["prefix"]))
+    tarball_name = unquote(request.match_info["tarball"]).strip()
+    ver = tarball_version(tarball_name)
+    if ver:
+        # 包名匹配忽略大小写；scoped 包同时匹配完整名与后半段名（完整名优先）
+        for v, fp in reversed(_candidate_entries(state["name_index"], package_name)):
+            if v == ver:
+                if fp.exists():
+                    # FileResponse 在支持的平台上自动使用 sendfile
+                    return web.FileResponse(fp, headers={"Content-Type": "application/gzip"})
+                break
+    raise web.HTTPNotFound()
+
+
+async def handle_packument(request):
+    state = request.app["state"]
+    package_name = _normalize_name(unquote(request.match_info["name"]))
+    if not package_name:
+        raise web.HTTPNotFound()
+    # npm 解析依赖时会反复请求同一 packument：按 (索引代数, 包名) 缓存序列化后的 bytes
+    cache = state["packument_cache"]
+    cache_key = (state["index_generation"], package_name)
+    body = cache.get(cache_key)
+    if body is None:
+        pack = build_packument(state["name_index"], state["base_url"], package_name)
+        body = json.dumps(pack).encode("utf-8") if pack else b""
+        if len(cache) >= PACKUMENT_CACHE_SIZE:
+            cache.clear()
+        cache[cache_key] = body
+    if not body:
+        raise web.HTTPNotFound()
+    return web.Response(body=body, content_type="application/json")
+
+
+def make_app(roots, index: dict, base_url: str):
+    app = web.Application()
+    app["state"] = {
+        "package_index": index,
+        "name_index": build_name_index(index),
+        "index_generation": 0,
+        "packument_cache": {},
+        "package_roots": roots,
+        "base_url": base_url,
+        "rescan_task": None,
+        "rescan_pending": False,
+        "rescan_scanning": False,
+        "rescan_error": None,
+    }
+    # add_get 默认同时注册 HEAD；rescan 需在通配路由之前注册
+    app.router.add_get("/-/rescan", handle_rescan)
+    app.router.add_get("/-/rescan-status", handle_rescan_status)
+    app.router.add_get("/{prefix:.+}/-/{tarball:[^/]+}", handle_tarball)
+    app.router.add_get("/{name:.+}", handle_packument)
+    return app
 
 
 def main():
@@ -189,34 +300,23 @@ def main():
             dirs_arg = argv[:-1] if len(argv) > 1 else ["packages"]
         else:
             dirs_arg = list(argv)
-    index = {}
-    for d in dirs_arg:
-        root = (base_dir / d).resolve()
-        if root.is_dir():
-            for k, v in scan_packages_dir(root).items():
-                index[k] = v
-        else:
+    roots = [(base_dir / d).resolve() for d in dirs_arg]
+    for root in roots:
+        if not root.is_dir():
             print(f"跳过不存在的目录: {root}", file=sys.stderr)
+    index = scan_roots(roots)
     print(f"已扫描 {len(index)} 个包版本，目录: {dirs_arg}", flush=True)
     host = "127.0.0.1"
     base_url = f"http://{host}:{port_arg}"
-    # npm 会并发拉取包，使用多线程 server 可显著降低连接中断/拒绝风险
-    try:
-        server = QuietThreadingHTTPServer((host, port_arg), LocalRegistryHandler)  # type: ignore
-        server.daemon_threads = True  # type: ignore[attr-defined]
-    except Exception:
-        server = HTTPServer((host, port_arg), LocalRegistryHandler)
-    roots = [base_dir.resolve() / d for d in dirs_arg]
-    server.package_index = index  # type: ignore
-    server.package_roots = roots  # type: ignore
-    server.base_url = base_url  # type: ignore
+    # npm 会并发拉取包：单线程 asyncio 即可承载大量并发连接，索引共享无需加锁
+    app = make_app(roots, index, base_url)
     print(f"本地 registry 已启动: {base_url}", flush=True)
     print("npm install --registry " + base_url, flush=True)
     try:
-        server.serve_forever()
+        web.run_app(app, host=host, port=port_arg, access_log=None, print=None)
     except KeyboardInterrupt:
-        print("\n已停止", flush=True)
-    server.shutdown()
+        pass
+    print("\n已停止", flush=True)
     sys.exit(0)
 
 
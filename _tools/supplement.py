@@ -2,23 +2,70 @@
 # -*- coding: utf-8 -*-
 """
 补包：从 npm install 日志解析缺包（404 / not found / notarget / lacks tarball），
-用 npm view 从公网取 tarball 并下载到 packages/。
+直接查公网 registry（精简 packument，失败回退 npm view）取 tarball 并下载到 packages/。
 
 职责：仅做「安装日志 → 缺包列表 → 下载到目录」；不启停 registry、不执行 npm install。
 用法：python supplement.py --log PATH --out-dir DIR [--report-file PATH] [--base-dir DIR]
   --report-file：将本轮补包列表写入该文件（每行 name@range），供 flow 读取。
 """
 
+import asyncio
+import functools
+import json
+import os
 import re
+import shutil
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+import common
 import config
 
 NPM_PUBLIC_REGISTRY = config.NPM_PUBLIC_REGISTRY
+RESOLVE_WORKERS = 8  # npm view 兜底解析的最大并发进程数
+REGISTRY_FETCH_LIMIT = 16  # 并发请求公网 registry packument 的最大连接数
+DOWNLOAD_WORKERS = config.PARALLEL_DOWNLOADS  # 并发下载 tarball 的线程数
+RESOLVE_CACHE_PATH = config.BASE_DIR / "logs" / ".tarball_cache.json"  # (源, name@range) → tarball 的解析缓存
+RESOLVE_CACHE_TTL = config.RESOLVE_CACHE_TTL  # 解析缓存有效期（秒）
+CURL_PARALLEL_MIN_VERSION = (7, 75)  # -Z 自 7.66，--write-out 的 %{exitcode} 自 7.75
+
+_resolve_cache: Optional[dict] = None
+_resolve_cache_mtime: Optional[int] = None  # 上次读取 / 写入时缓存文件的 mtime_ns
+_curl_parallel_ok: Optional[bool] = None
+_log_parse_cache: dict = {}  # (日志路径, 大小, mtime_ns) -> 解析结果，只保留最近一份
+
+# 日志解析用到的正则统一在模块加载时编译
+_RE_404_NOT_IN_REGISTRY = re.compile(r"404\s+[^']*'([^']+)'\s+is not in this registry", re.I)
+_RE_404_NOT_FOUND = re.compile(r"Package\s+'([^']+)'\s+not found", re.I)
+_RE_NOTARGET = re.compile(r"notarget\s+No matching version found for\s+(.+?)@(\S+)", re.I)
+_RE_LACKS_TARBALL = re.compile(r"Package\s+([^\s]+)\s+lacks\s+tarball\s+version\s+(\S+)", re.I)
+_RE_SPEC_WITH_URL = re.compile(r'^(@?[^@]+)@(https?://.+)$')
+_RE_TAIL_SEMVER = re.compile(r"-(\d+\.\d+\.\d+.*)$")
+_RE_BARE_MAJOR = re.compile(r"^\d+\.?$")
+_RE_CURL_VERSION = re.compile(r"curl (\d+)\.(\d+)")
+_RE_EXACT_VERSION = re.compile(r"^\d+\.\d+\.\d+(?:-[0-9A-Za-z.-]+)?$")
+# 本地选版本只接受与 npm semver 结果完全一致的 range 形式：^（主版本 >= 1）、~、x-range（2、1.2、1.x、*）；
+# 其余（^0.x、比较符组合、|| 、连字符范围、带预发布标识等）交给 npm view
+_RE_LOCAL_RANGE = re.compile(r"^(?:\^[1-9]\d*|~\d+|\d+)(?:\.(?:\d+|[xX*])){0,2}$|^[xX*]$")
+
+# 进程内共用一个 Session（flow.SESSION 即此对象）：连接池与下载线程数一致，各线程复用 keep-alive 连接；
+# GET 遇 502/503/504 由适配器退避重试。连接错误、读超时适配器不重试（connect=0、read=0）：
+# flow._get_with_retry 自己按退避重试这两类错误，适配器再重试会叠加成 4×3 次；补包失败另有 curl 兜底
+SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=DOWNLOAD_WORKERS,
+    pool_maxsize=DOWNLOAD_WORKERS,
+    max_retries=Retry(total=3, connect=0, read=0, status=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+SESSION.mount("http://", _ADAPTER)
+SESSION.mount("https://", _ADAPTER)
 
 
 def _extract_version_from_tarball_url(url: str, package_name: str) -> str:
@@ -32,52 +79,78 @@ def _extract_version_from_tarball_url(url: str, package_name: str) -> str:
     if basename.startswith(prefix):
         return basename[len(prefix):]           # "0.27.10"
     # fallback: 末尾 semver
-    m = re.search(r"-(\d+\.\d+\.\d+.*)$", basename)
+    m = _RE_TAIL_SEMVER.search(basename)
     return m.group(1) if m else ""
 
 
 def extract_404_from_npm_install_log(log_path: Path) -> List[Tuple[str, str]]:
     """从 npm install 日志解析缺包，返回 [(包名, 版本范围), ...]。
     兼容 lock 被重写为本地 registry URL 后，npm 404 中 range 为完整 URL 的情况。"""
-    if not log_path.exists():
+    try:
+        st = log_path.stat()
+    except OSError:
         return []
-    text = log_path.read_text(encoding="utf-8", errors="ignore")
-    found: List[Tuple[str, str]] = []
+    # 同一份日志（路径、大小、修改时间均未变）只解析一次，如 main 末尾判断退出码时的再次调用
+    key = (str(log_path), st.st_size, st.st_mtime_ns)
+    cached = _log_parse_cache.get(key)
+    if cached is not None:
+        return list(cached)
+    # 逐行读取并先用子串预筛，与安装时逐行解析的结果一致；不把整份日志读入内存再跑多遍正则
+    found: dict = {}
+    with log_path.open(encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            if may_report_missing(line):
+                found.update(dict.fromkeys(extract_404_from_text(line)))
+    _log_parse_cache.clear()
+    _log_parse_cache[key] = tuple(found)
+    return list(found)
+
+
+# 缺包相关输出必含的关键字（小写）；逐行解析时先用子串判断，绝大多数无关行不必跑正则
+_MISSING_HINTS = ("404", "not found", "notarget", "lacks")
+
+
+def may_report_missing(line: str) -> bool:
+    """该行是否可能包含缺包信息（extract_404_from_text 的廉价预筛）。"""
+    low = line.lower()
+    return any(h in low for h in _MISSING_HINTS)
+
+
+def extract_404_from_text(text: str) -> List[Tuple[str, str]]:
+    """从 npm 输出文本（整份日志或单行）解析缺包，规则同 extract_404_from_npm_install_log。"""
+    # dict 当有序集合：插入即去重，并保持首次出现顺序
+    found: dict = {}
+    # 每个正则只在文本含其关键字时才执行：逐行调用时一行通常只命中一种，其余几遍扫描直接省掉。
+    # 不加 ^ 锚定：npm 不同版本/日志级别的行前缀不一（npm ERR! / npm error / 时间戳），锚定易漏报
+    low = text.lower()
 
     # 'name@range_or_url' is not in this registry
-    for m in re.finditer(r"404\s+[^']*'([^']+)'\s+is not in this registry", text, re.I):
+    for m in _RE_404_NOT_IN_REGISTRY.finditer(text) if "not in this registry" in low else ():
         full = m.group(1).strip()
         # range 为 URL 时（lock resolved 被重写），从 URL 提取真实版本
-        url_m = re.match(r'^(@?[^@]+)@(https?://.+)$', full)
+        url_m = _RE_SPEC_WITH_URL.match(full)
         if url_m:
             name = url_m.group(1)
             version = _extract_version_from_tarball_url(url_m.group(2), name)
             if version:
-                found.append((name, version))
+                found[(name, version)] = None
                 continue
         if "@" in full:
             name, rng = full.rsplit("@", 1)
             name, rng = name.strip(), rng.strip().rstrip(".")
             if name and rng:
-                found.append((name, rng))
-
-    for m in re.finditer(r"Package\s+'([^']+)'\s+not found", text, re.I):
-        found.append((m.group(1).strip(), "latest"))
-    for m in re.finditer(r"notarget\s+No matching version found for\s+(.+?)@(\S+)", text, re.I):
-        found.append((m.group(1).strip(), m.group(2).strip().rstrip(".")))
-    for m in re.finditer(r"Package\s+([^\s]+)\s+lacks\s+tarball\s+version\s+(\S+)", text, re.I):
-        found.append((m.group(1).strip().rstrip("."), m.group(2).strip().rstrip(".")))
-    seen = set()
-    out: List[Tuple[str, str]] = []
-    for name, rng in found:
-        k = f"{name}@{rng}"
-        if k in seen:
-            continue
-        seen.add(k)
-        out.append((name, rng))
-    return out
+                found[(name, rng)] = None
+
+    for m in _RE_404_NOT_FOUND.finditer(text) if "not found" in low else ():
+        found[(m.group(1).strip(), "latest")] = None
+    for m in _RE_NOTARGET.finditer(text) if "notarget" in low else ():
+        found[(m.group(1).strip(), m.group(2).strip().rstrip("."))] = None
+    for m in _RE_LACKS_TARBALL.finditer(text) if "lacks" in low else ():
+        found[(m.group(1).strip().rstrip("."), m.group(2).strip().rstrip("."))] = None
+    return list(found)
 
 
+@functools.lru_cache(maxsize=4096)
 def safe_tarball_basename(package_name: str, version: str) -> str:
     name = (package_name or "").strip()
     ver = (version or "").strip()
@@ -87,45 +160,131 @@ def safe_tarball_basename(package_name: str, version: str) -> str:
     return f"{part}-{ver}.tgz"
 
 
-def get_tarball_via_npm_view(
-    name: str, range_spec: str, base_dir: Path, verbose: bool = True
-) -> Optional[Tuple[str, str]]:
-    """用 npm view 从公网获取 tarball URL 与版本。"""
+def _normalize_range(name: str, range_spec: str) -> str:
     range_spec = (range_spec or "").strip().rstrip(".")
     if name == "@tootallnate/once" and (
-        not range_spec or range_spec in ("1", "1.") or re.match(r"^\d+\.?$", range_spec)
+        not range_spec or range_spec in ("1", "1.") or _RE_BARE_MAJOR.match(range_spec)
     ):
         range_spec = "2"
+    return range_spec
+
+
+def _pick_from_packument(data, range_spec: str) -> Optional[Tuple[str, str]]:
+    """从 packument 中按 range 选版本，返回 (tarball URL, 版本)。range 依次按 dist-tag、精确版本匹配；
+    只有 _RE_LOCAL_RANGE 认可的形式才交给 common.pick_best_version（只选正式版）。其余形式或没有满足的版本
+    返回 None，由调用方回退 npm view，避免本地选出 npm 不会选的版本、补包后安装仍然失败。"""
+    if not isinstance(data, dict):
+        return None
+    versions = data.get("versions") or {}
+    version = (data.get("dist-tags") or {}).get(range_spec or "latest")
+    if version not in versions:
+        if range_spec in versions:
+            version = range_spec
+        elif _RE_LOCAL_RANGE.match(range_spec):
+            version = common.pick_best_version(versions, range_spec)
+        else:
+            version = None
+    if not version:
+        return None
+    url = str(((versions.get(version) or {}).get("dist") or {}).get("tarball") or "")
+    return (url, version) if url.startswith("http") else None
+
+
+async def _fetch_packuments(names: List[str]) -> dict:
+    """在一个事件循环里用 aiohttp 并发请求公网 registry 的精简 packument，返回 {包名: packument 或 None}。
+    复用 download.fetch_packument（corgi Accept、429/5xx 退避重试、orjson 解析）。
+    aiohttp 与 download（依赖 PyYAML）在这里才导入：flow 会 import 本模块，顶层不引入这两个依赖。"""
+    import aiohttp
+    import download
+
+    registry = NPM_PUBLIC_REGISTRY.rstrip("/")
+    connector = aiohttp.TCPConnector(limit=REGISTRY_FETCH_LIMIT)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        results = await asyncio.gather(*(download.fetch_packument(session, n, registry) for n in names))
+    return dict(zip(names, results))
+
+
+def _resolve_cache_file_mtime() -> Optional[int]:
+    try:
+        return RESOLVE_CACHE_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load_resolve_cache() -> dict:
+    """读取磁盘缓存 {"源 name@range": [url, version, 解析时间]}，读取时丢弃过期条目。
+    文件 mtime 未变时直接用内存中的副本；变了（如 flow 进程内预补与 supplement 子进程交替写入）就重新读入
+    并与内存条目合并，避免后写的一方用旧副本覆盖掉对方新解析的结果。"""
+    global _resolve_cache, _resolve_cache_mtime
+    mtime = _resolve_cache_file_mtime()
+    if _resolve_cache is not None and mtime == _resolve_cache_mtime:
+        return _resolve_cache
+    merged = dict(_resolve_cache or {})
+    try:
+        raw = json.loads(RESOLVE_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raw = {}
+    if isinstance(raw, dict):
+        for key, item in raw.items():
+            if isinstance(item, list) and len(item) == 3:
+                old = merged.get(key)
+                if old is None or old[2] < item[2]:
+                    merged[key] = item
+    now = time.time()
+    _resolve_cache = {k: v for k, v in merged.items() if now - v[2] < RESOLVE_CACHE_TTL}
+    _resolve_cache_mtime = mtime
+    return _resolve_cache
+
+
+def _save_resolve_cache() -> None:
+    global _resolve_cache_mtime
+    if not _resolve_cache:
+        return
+    # 写盘前先合并别的进程在此期间写入的条目
+    _load_resolve_cache()
+    try:
+        RESOLVE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = RESOLVE_CACHE_PATH.with_suffix(".tmp")
+        tmp.write_text(json.dumps(_resolve_cache, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, RESOLVE_CACHE_PATH)
+        _resolve_cache_mtime = _resolve_cache_file_mtime()
+    except OSError:
+        pass
+
+
+def get_tarball_via_npm_view(
+    name: str, range_spec: str, base_dir: Path, verbose: bool = True
+) -> Optional[Tuple[str, str]]:
+    """用 npm view 从公网获取 tarball URL 与版本。"""
+    range_spec = _normalize_range(name, range_spec)
     spec = f"{name}@{range_spec}" if range_spec else name
     npm_exe = config.NPM
     reg = f"--registry={NPM_PUBLIC_REGISTRY}"
     try:
+        # 一次 npm view 同时取 dist.tarball 与 version（--json），省去第二次 npm 启动与 registry 请求
         out = subprocess.run(
-            [npm_exe, "view", spec, "dist.tarball", reg],
+            [npm_exe, "view", spec, "dist.tarball", "version", "--json", reg],
             capture_output=True,
             encoding="utf-8",
             timeout=25,
             cwd=str(base_dir),
         )
         if verbose:
-            print(f"  执行: {npm_exe} view {spec} dist.tarball {reg}", flush=True)
+            print(f"  执行: {npm_exe} view {spec} dist.tarball version --json {reg}", flush=True)
         if out.returncode != 0 or not out.stdout or not out.stdout.strip():
             if verbose:
                 print(f"  失败: 退出码 {out.returncode}, stderr: {(out.stderr or '')[:150]}", flush=True)
             return None
-        url = out.stdout.strip()
+        info = json.loads(out.stdout)
+        # range 命中多个版本时 npm 返回按版本升序的数组，取最后一个（最高版本）
+        if isinstance(info, list):
+            info = info[-1] if info else {}
+        if not isinstance(info, dict):
+            return None
+        url = str(info.get("dist.tarball") or "").strip()
         if not url.startswith("http"):
             return None
-        out2 = subprocess.run(
-            [npm_exe, "view", spec, "version", reg],
-            capture_output=True,
-            encoding="utf-8",
-            timeout=25,
-            cwd=str(base_dir),
-        )
-        version = (out2.stdout or "").strip() if out2.returncode == 0 else ""
-        if not version:
-            version = "unknown"
+        version = str(info.get("version") or "").strip() or "unknown"
         if verbose:
             print(f"  得到: version={version}, tarball={url[:70]}...", flush=True)
         return (url, version)
@@ -135,9 +294,51 @@ def get_tarball_via_npm_view(
         return None
 
 
+def resolve_tarballs(entries: List[Tuple[str, str]], base_dir: Path) -> List[Optional[Tuple[str, str]]]:
+    """批量解析 (tarball URL, 版本)，结果与 entries 一一对应。先查解析缓存（TTL 内的多轮 / 多次运行复用）；
+    其余按包名去重，每个包只取一次 packument（aiohttp 并发），再在本地按各 range 选版本；
+    仍解析不了的用 npm view 兜底（多个时线程池并发且不逐条打印，避免输出交错）。只缓存成功结果。"""
+    cache = _load_resolve_cache()
+    now = time.time()
+    # 键含源地址：切换公网源后不复用旧源解析出的 URL
+    keys = [f"{NPM_PUBLIC_REGISTRY} {name}@{rng}" for name, rng in entries]
+    pairs: List[Optional[Tuple[str, str]]] = []
+    for key in keys:
+        item = cache.get(key)
+        pairs.append((item[0], item[1]) if item and now - item[2] < RESOLVE_CACHE_TTL else None)
+    todo = [i for i, pair in enumerate(pairs) if pair is None]
+    if not todo:
+        return pairs
+    names = list(dict.fromkeys(entries[i][0] for i in todo))
+    print(f"查询 registry：{len(names)} 个包 ...", flush=True)
+    try:
+        packuments = asyncio.run(_fetch_packuments(names))
+    except ImportError:  # 未安装 aiohttp / PyYAML：全部交给下面的 npm view 兜底
+        packuments = {}
+    for i in todo:
+        name, rng = entries[i]
+        pairs[i] = _pick_from_packument(packuments.get(name), _normalize_range(name, rng))
+    fallback = [i for i in todo if pairs[i] is None]
+    if len(fallback) == 1:
+        pairs[fallback[0]] = get_tarball_via_npm_view(*entries[fallback[0]], base_dir, verbose=True)
+    elif fallback:
+        print(f"并发 npm view 解析 {len(fallback)} 个缺包 ...", flush=True)
+        with ThreadPoolExecutor(max_workers=min(RESOLVE_WORKERS, len(fallback))) as ex:
+            views = ex.map(lambda i: get_tarball_via_npm_view(*entries[i], base_dir, verbose=False), fallback)
+            for i, pair in zip(fallback, views):
+                pairs[i] = pair
+    for i in todo:
+        if pairs[i]:
+            cache[keys[i]] = [pairs[i][0], pairs[i][1], now]
+        else:
+            print(f"  未取到 tarball: {entries[i][0]}@{entries[i][1]}", flush=True)
+    _save_resolve_cache()
+    return pairs
+
+
 def download_via_curl(url: str, dest: Path, timeout: int = 60) -> bool:
     curl_exe = config.CURL
-    cmd = [curl_exe, "-L", "-s", "-S", "-o", str(dest), "--connect-timeout", "15", "--max-time", str(timeout), url]
+    cmd = [curl_exe, "-L", "-s", "-S", "--fail", "-o", str(dest), "--connect-timeout", "15", "--max-time", str(timeout), url]
     try:
         r = subprocess.run(cmd, capture_output=True, encoding="utf-8", errors="replace", timeout=timeout + 10)
         return r.returncode == 0 and dest.exists() and dest.stat().st_size > 0
@@ -145,42 +346,154 @@ def download_via_curl(url: str, dest: Path, timeout: int = 60) -> bool:
         return False
 
 
+def _curl_supports_parallel() -> bool:
+    """curl 是否支持 -Z 并发与 %{exitcode}（>= 7.75），进程内只探测一次。"""
+    global _curl_parallel_ok
+    if _curl_parallel_ok is None:
+        _curl_parallel_ok = False
+        try:
+            r = subprocess.run([config.CURL, "--version"], capture_output=True, encoding="utf-8", errors="replace", timeout=10)
+            m = _RE_CURL_VERSION.match(r.stdout or "")
+            _curl_parallel_ok = bool(m) and (int(m.group(1)), int(m.group(2))) >= CURL_PARALLEL_MIN_VERSION
+        except Exception:
+            pass
+    return _curl_parallel_ok
+
+
+def _curl_config_quote(value: str) -> str:
+    # curl 配置文件的双引号值内会解释反斜杠转义（Windows 路径）
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def download_via_curl_batch(items: List[Tuple[str, Path]], timeout: int = 60) -> List[bool]:
+    """一个 curl 进程并发下载多个文件（-Z，最多 DOWNLOAD_WORKERS 路），URL/输出经 stdin 以 --config 传入，
+    省去每个文件一次进程启动，同主机连接复用。各文件先写 .part，按 curl 逐个报告的退出码决定改名或删除。
+    返回与 items 一一对应的是否成功。"""
+    parts = {str(dst.with_name(dst.name + ".part")): i for i, (_, dst) in enumerate(items)}
+    cfg = "".join(
+        f'url = "{_curl_config_quote(url)}"\noutput = "{_curl_config_quote(part)}"\n'
+        for (url, _), part in zip(items, parts)
+    )
+    cmd = [
+        config.CURL, "-L", "-s", "-S", "--fail", "-Z", "--parallel-max", str(DOWNLOAD_WORKERS),
+        "--connect-timeout", "15", "--max-time", str(timeout),
+        "--write-out", "%{exitcode}\t%{filename_effective}\n", "--config", "-",
+    ]
+    ok = [False] * len(items)
+    try:
+        # 每路最多 timeout 秒，按「批次数 × timeout」给整体加上限
+        r = subprocess.run(
+            cmd, input=cfg, capture_output=True, encoding="utf-8", errors="replace",
+            timeout=timeout * (len(items) // DOWNLOAD_WORKERS + 1) + 10,
+        )
+        for line in (r.stdout or "").splitlines():
+            code, _, part = line.partition("\t")
+            i = parts.get(part)
+            if i is not None and code == "0":
+                ok[i] = True
+    except Exception:
+        pass
+    for (_, dst), part, success in zip(items, parts, ok):
+        part_path = Path(part)
+        try:
+            if success and part_path.stat().st_size > 0:
+                os.replace(part_path, dst)
+                continue
+        except OSError:
+            pass
+        part_path.unlink(missing_ok=True)
+    return [success and dst.exists() for (_, dst), success in zip(items, ok)]
+
+
+def _download_via_session(url: str, dest: Path, timeout: int = 60) -> None:
+    """用模块级 SESSION 流式下载到 dest（复用 keep-alive 连接，不起子进程），失败抛异常。"""
+    with SESSION.get(url, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        with dest.open("wb") as f:
+            shutil.copyfileobj(r.raw, f, 1024 * 1024)
+
+
+def download_one_tarball(url: str, dst: Path, timeout: int = 60) -> Tuple[bool, List[str]]:
+    """下载单个 tarball 到 dst（已存在且非空则跳过），先用连接池化的 requests Session，失败再用 curl 兜底
+    （如代理 / 证书只对 curl 配好的环境）。
+    两种方式都先写 dst.part，确认非空后再 os.replace 到 dst，中断或失败只会留下（并清掉）.part，
+    不会在 dst 留下被下次「已存在」误判的半截文件。
+    返回 (是否成功, 过程输出行)；不直接打印，便于并发时由调用方按包成段输出。"""
+    fn = dst.name
+    if dst.exists() and dst.stat().st_size > 0:
+        return True, [f"  已存在: {fn}"]
+    part = dst.with_name(fn + ".part")
+    lines = [f"  下载: {fn}"]
+    try:
+        try:
+            _download_via_session(url, part, timeout=timeout)
+        except Exception as e:
+            lines.append(f"  requests 下载失败（{e}），改用 curl ...")
+            if not download_via_curl(url, part, timeout=timeout):
+                lines.append("  下载失败")
+                return False, lines
+        if part.stat().st_size > 0:
+            os.replace(part, dst)
+            lines.append(f"  已写入: {dst}")
+            return True, lines
+    except OSError:
+        pass
+    finally:
+        part.unlink(missing_ok=True)
+    lines.append("  下载失败")
+    return False, lines
+
+
 def download_tarballs_with_names(
     entries: List[Tuple[str, str]], out_dir: Path, base_dir: Path, timeout: int = 60
 ) -> List[Tuple[str, str]]:
-    """将缺包列表用 npm view 取 tarball 并下载到 out_dir，返回成功下载的 [(name, range), ...]。"""
+    """将缺包列表解析为 tarball（resolve_tarballs：缓存、公网 packument，npm view 兜底）并下载到 out_dir，
+    返回成功下载的 [(name, range), ...]。"""
     out_dir.mkdir(parents=True, exist_ok=True)
     supplemented: List[Tuple[str, str]] = []
-    for name, rng in entries:
-        print(f"缺包: {name}@{rng}", flush=True)
-        pair = get_tarball_via_npm_view(name, rng, base_dir, verbose=True)
+    # 解析前先去重，并跳过精确版本且 tarball 已在 out_dir 的条目（如被预补过）：文件名可直接推出，不必再 npm view
+    to_resolve: List[Tuple[str, str]] = []
+    for name, rng in dict.fromkeys(entries):
+        if _RE_EXACT_VERSION.match(rng):
+            dst = out_dir / safe_tarball_basename(name, rng)
+            if dst.exists() and dst.stat().st_size > 0:
+                print(f"缺包: {name}@{rng}\n  已存在: {dst.name}", flush=True)
+                supplemented.append((name, rng))
+                continue
+        to_resolve.append((name, rng))
+    # 不同 range 可能解析到同一版本：按目标文件归并，每个文件只下载一次，也避免两个线程写同一路径
+    by_fn: dict = {}
+    for (name, rng), pair in zip(to_resolve, resolve_tarballs(to_resolve, base_dir)):
         if not pair:
+            print(f"缺包: {name}@{rng}", flush=True)
             continue
         url, version = pair
-        fn = safe_tarball_basename(name, version)
-        dst = out_dir / fn
-        if dst.exists() and dst.stat().st_size > 0:
-            print(f"  已存在: {fn}", flush=True)
-            supplemented.append((name, rng))
-            continue
-        print(f"  下载: curl -o {fn}", flush=True)
-        if not download_via_curl(url, dst, timeout=timeout):
-            print("  curl 失败，改用 requests 下载 ...", flush=True)
-            try:
-                r = requests.get(url, stream=True, timeout=timeout)
-                r.raise_for_status()
-                with dst.open("wb") as f:
-                    for chunk in r.iter_content(chunk_size=1024 * 256):
-                        if chunk:
-                            f.write(chunk)
-            except Exception as e:
-                print(f"  下载失败: {e}", flush=True)
-                continue
-        if dst.exists() and dst.stat().st_size > 0:
-            print(f"  已写入: {dst}", flush=True)
-            supplemented.append((name, rng))
-        else:
-            print("  下载失败", flush=True)
+        by_fn.setdefault(safe_tarball_basename(name, version), (url, []))[1].append((name, rng))
+    if not by_fn:
+        return supplemented
+    jobs = [(fn, url, specs) for fn, (url, specs) in by_fn.items()]
+
+    # 多个待下载时先交给一个 curl -Z 进程并发下完；失败的再逐个走 curl / requests
+    batched: set = set()
+    pending = [(fn, url) for fn, url, _ in jobs if not (out_dir / fn).exists()]
+    if len(pending) > 1 and _curl_supports_parallel():
+        print(f"curl 并发下载 {len(pending)} 个 tarball ...", flush=True)
+        results = download_via_curl_batch([(url, out_dir / fn) for fn, url in pending], timeout=timeout)
+        batched = {fn for (fn, _), ok in zip(pending, results) if ok}
+
+    def job(item):
+        fn, url, _ = item
+        if fn in batched:
+            return True, [f"  已写入: {out_dir / fn}"]
+        return download_one_tarball(url, out_dir / fn, timeout)
+
+    # 下载为 I/O 等待（curl 子进程 / socket），线程池并发；map 按提交顺序返回，输出按包成段打印不交错
+    with ThreadPoolExecutor(max_workers=min(DOWNLOAD_WORKERS, len(jobs))) as ex:
+        for (_, _, specs), (ok, lines) in zip(jobs, ex.map(job, jobs)):
+            print("\n".join([f"缺包: {n}@{r}" for n, r in specs] + lines), flush=True)
+            if ok:
+                supplemented.extend(specs)
     return supplemented
 
 
@@ -195,10 +508,8 @@ def run(
     解析 log 中的缺包，下载到 out_dir。若提供 only_new，则只下载该子集（用于 flow 去重）。
     返回本轮成功下载的 [(name, range), ...]（含已存在而跳过的）。
     """
-    missing = extract_404_from_npm_install_log(log_path)
-    if not missing:
-        return []
-    to_download = only_new if only_new is not None else missing
+    # flow 传入的 only_new 本就由同一份日志解析、去重得到，此时不必再整份读日志
+    to_download = only_new if only_new is not None else extract_404_from_npm_install_log(log_path)
     if not to_download:
         return []
     return download_tarballs_with_names(to_download, out_dir, base_dir, timeout=timeout)